@@ -0,0 +1,119 @@
+"""Benchmarks for :mod:`nanos.data`.
+
+Run from the project root::
+
+    python -m benchmarks.bench_data
+"""
+
+import typing as t
+from types import SimpleNamespace
+
+from nanos import bench, data
+
+ROWS: t.Final = 100_000
+ROUNDS: t.Final = 5
+WARMUP: t.Final = 1
+
+
+def legacy_idfy(obj: t.Any, id_field_name: str = "id") -> dict[t.Any, t.Any]:
+    """Recursive implementation of :func:`nanos.data.idfy` from nanos 0.1.9."""
+    if isinstance(obj, dict):
+        return {obj[id_field_name]: obj}
+    if isinstance(obj, (list, set, tuple, t.Generator)):
+        return {k: v for d in obj for k, v in legacy_idfy(d, id_field_name).items()}
+    return {getattr(obj, id_field_name): obj}
+
+
+def legacy_remove_empty_members(obj: t.Any, empty: list[t.Any] | None = None) -> t.Any:
+    """Recursive implementation of :func:`nanos.data.remove_empty_members` from nanos 0.1.9."""
+    empty = empty or data.EMPTY_VALUES
+    if type(obj) is dict:
+        for key in list(obj.keys()):
+            obj[key] = legacy_remove_empty_members(obj[key], empty)
+            if obj[key] is None:
+                del obj[key]
+    elif type(obj) is list:
+        cleaned = (legacy_remove_empty_members(item, empty) for item in obj)
+        obj = [item for item in cleaned if item not in empty]
+    return None if obj in empty else obj
+
+
+def make_payload(rows: int) -> list[dict[str, t.Any]]:
+    return [
+        {
+            "id": i,
+            "name": f"user {i}",
+            "bio": "",
+            "score": i * 0.5,
+            "active": i % 2 == 0,
+            "tags": ["a", "", "b", None],
+            "address": {"city": "x", "zip": "", "geo": {"lat": None, "lon": None}},
+            "orders": [{"id": i, "items": [], "note": ""}, {}],
+        }
+        for i in range(rows)
+    ]
+
+
+def make_wide_payload(rows: int) -> list[dict[str, t.Any]]:
+    return [{f"field_{n}": ("" if n % 3 else n * i) for n in range(30)} for i in range(rows)]
+
+
+def on_fresh_inputs(
+    func: t.Callable[[t.Any], t.Any], make_input: t.Callable[[], t.Any]
+) -> t.Callable[[], t.Any]:
+    """Makes a benchmark function calling ``func`` on a new input every round.
+
+    Inputs are made upfront, so their creation is not timed, and functions
+    cleaning them in place get a dirty input every time.
+    """
+    inputs = iter([make_input() for _ in range(ROUNDS + WARMUP)])
+    return lambda: func(next(inputs))
+
+
+def compare(
+    title: str,
+    baseline: t.Callable[[t.Any], t.Any],
+    candidate: t.Callable[[t.Any], t.Any],
+    make_input: t.Callable[[], t.Any],
+) -> None:
+    comparison = bench.compare_funcs(
+        on_fresh_inputs(baseline, make_input),
+        on_fresh_inputs(candidate, make_input),
+        name=title,
+        rounds=ROUNDS,
+        warmup=WARMUP,
+        iterations=1,
+    )
+    print(comparison)
+
+
+def bench_idfy() -> None:
+    def dicts() -> list[dict[str, t.Any]]:
+        return [{"id": i, "name": str(i)} for i in range(ROWS)]
+
+    def objects() -> list[SimpleNamespace]:
+        return [SimpleNamespace(id=i, name=str(i)) for i in range(ROWS)]
+
+    compare(f"idfy, {ROWS} dicts", legacy_idfy, data.idfy, dicts)
+    compare(f"idfy, {ROWS} objects", legacy_idfy, data.idfy, objects)
+
+
+def bench_remove_empty_members() -> None:
+    rows = ROWS // 10
+    compare(
+        f"remove_empty_members, {rows} records",
+        legacy_remove_empty_members,
+        data.remove_empty_members,
+        lambda: make_payload(rows),
+    )
+    compare(
+        f"remove_empty_members, {rows} wide records",
+        legacy_remove_empty_members,
+        data.remove_empty_members,
+        lambda: make_wide_payload(rows),
+    )
+
+
+if __name__ == "__main__":
+    bench_idfy()
+    bench_remove_empty_members()
@@ -0,0 +1,44 @@
+"""Benchmarks for :mod:`nanos.fmt`.
+
+Run from the project root::
+
+    python -m benchmarks.bench_fmt
+"""
+
+import random
+import typing as t
+from array import array
+from functools import partial
+
+from nanos import bench, fmt
+
+VALUES: t.Final = 100_000
+
+
+def scalar_sizes(values: t.Sequence[int | float]) -> list[str]:
+    """Formats sizes one by one with :func:`nanos.fmt.size`."""
+    return [fmt.size(value) for value in values]
+
+
+def make_values(rows: int) -> list[int]:
+    rng = random.Random(42)
+    return [rng.randrange(1024 ** rng.randrange(1, 6)) for _ in range(rows)]
+
+
+def bench_sizes() -> None:
+    values = make_values(VALUES)
+    floats = array("d", values)
+    out = [""] * VALUES
+    candidates = {
+        f"sizes, {VALUES} ints": partial(fmt.sizes, values),
+        f"sizes, {VALUES} ints into a preallocated list": partial(fmt.sizes, values, out=out),
+        f"sizes, array of {VALUES} floats": partial(fmt.sizes, floats),
+    }
+    for name, candidate in candidates.items():
+        baseline = bench.benchmark(partial(scalar_sizes, values), rounds=5, warmup=1)
+        result = bench.benchmark(candidate, name=name, rounds=5, warmup=1)
+        print(bench.compare(baseline, result))
+
+
+if __name__ == "__main__":
+    bench_sizes()
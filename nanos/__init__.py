@@ -1,2 +1,2 @@
 # ruff: noqa: F401
-from nanos import data, dt, fmt, logging, time
+from nanos import bench, data, dt, fmt, logging, time
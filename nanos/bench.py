@@ -0,0 +1,423 @@
+from __future__ import annotations
+
+import functools
+import json
+import math
+import os
+import statistics
+import typing as t
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from nanos.time import NS_PER_SECOND, Clock, ClockName, Timer
+
+DEFAULT_ROUNDS: t.Final = 20
+DEFAULT_WARMUP_ROUNDS: t.Final = 3
+DEFAULT_ROUND_TIME: t.Final = 0.05
+DEFAULT_THRESHOLD: t.Final = 0.05
+OUTLIER_IQR_FACTOR: t.Final = 1.5
+
+Verdict = t.Literal["faster", "slower", "same"]
+
+_MAX_CALIBRATION_GROWTH: t.Final = 10
+_TIME_UNITS: t.Final = ((1.0, "s"), (1e-3, "ms"), (1e-6, "us"), (1e-9, "ns"))
+
+
+@dataclass(frozen=True, slots=True)
+class BenchmarkResult:
+    """
+    Result of a benchmark, timings of all measured rounds.
+
+    Statistics are calculated from per-iteration timings of rounds, so every
+    round gives a single sample.
+
+    Attributes:
+        name (str): Name of the benchmark.
+        iterations (int): Number of calls of the function per round.
+        timings (tuple[float, ...]): Time of a single call in seconds, averaged
+            over every round.
+    """
+
+    name: str
+    iterations: int
+    timings: tuple[float, ...]
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {_format_seconds(self.median)} "
+            f"(IQR {_format_seconds(self.iqr)}, {self.rounds}x{self.iterations})"
+        )
+
+    @property
+    def rounds(self) -> int:
+        """Number of measured rounds."""
+        return len(self.timings)
+
+    @property
+    def mean(self) -> float:
+        """The mean time of a call in seconds."""
+        return statistics.fmean(self.timings)
+
+    @property
+    def stdev(self) -> float:
+        """The sample standard deviation of call time in seconds, 0.0 for a single round."""
+        return statistics.stdev(self.timings) if self.rounds > 1 else 0.0
+
+    @property
+    def median(self) -> float:
+        """The median time of a call in seconds."""
+        return statistics.median(self.timings)
+
+    @property
+    def min(self) -> float:
+        """The minimum time of a call in seconds."""
+        return min(self.timings)
+
+    @property
+    def max(self) -> float:
+        """The maximum time of a call in seconds."""
+        return max(self.timings)
+
+    @property
+    def q1(self) -> float:
+        """The first quartile of call time in seconds."""
+        return self._quartiles()[0]
+
+    @property
+    def q3(self) -> float:
+        """The third quartile of call time in seconds."""
+        return self._quartiles()[2]
+
+    @property
+    def iqr(self) -> float:
+        """The interquartile range of call time in seconds."""
+        q1, _, q3 = self._quartiles()
+        return q3 - q1
+
+    @property
+    def outliers(self) -> tuple[float, ...]:
+        """Timings further than 1.5 IQR below the first or above the third quartile."""
+        q1, _, q3 = self._quartiles()
+        low, high = q1 - OUTLIER_IQR_FACTOR * (q3 - q1), q3 + OUTLIER_IQR_FACTOR * (q3 - q1)
+        return tuple(timing for timing in self.timings if not low <= timing <= high)
+
+    def summary(self) -> dict[str, float]:
+        """
+        Returns statistics of the benchmark.
+
+        Returns:
+            dict[str, float]: Rounds, iterations, mean, stdev, median, min,
+            max, q1, q3, iqr and number of outliers, times are in seconds.
+        """
+        q1, median, q3 = self._quartiles()
+        return {
+            "rounds": self.rounds,
+            "iterations": self.iterations,
+            "mean": self.mean,
+            "stdev": self.stdev,
+            "median": median,
+            "min": self.min,
+            "max": self.max,
+            "q1": q1,
+            "q3": q3,
+            "iqr": q3 - q1,
+            "outliers": len(self.outliers),
+        }
+
+    def to_dict(self) -> dict[str, t.Any]:
+        """
+        Converts the result into a JSON-serializable dict.
+
+        Returns:
+            dict[str, t.Any]: Name, iterations and timings of the result.
+        """
+        return {"name": self.name, "iterations": self.iterations, "timings": list(self.timings)}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, t.Any]) -> BenchmarkResult:
+        """
+        Creates a result from a dict made by :meth:`to_dict`.
+
+        Args:
+            data (dict[str, t.Any]): The dict.
+
+        Returns:
+            BenchmarkResult: The result.
+
+        Raises:
+            ValueError: If the dict has no timings.
+        """
+        if not data.get("timings"):
+            raise ValueError(f"Benchmark result {data.get('name')!r} has no timings")
+        return cls(data["name"], data["iterations"], tuple(data["timings"]))
+
+    def _quartiles(self) -> tuple[float, float, float]:
+        if self.rounds < 2:
+            return self.timings[0], self.timings[0], self.timings[0]
+        q1, median, q3 = statistics.quantiles(self.timings, n=4, method="inclusive")
+        return q1, median, q3
+
+
+@dataclass(frozen=True, slots=True)
+class Comparison:
+    """
+    Comparison of a candidate benchmark result with a baseline one.
+
+    The candidate is considered slower or faster only if its median differs by
+    more than the threshold and interquartile ranges of results don't overlap,
+    so the noise of measurements is not reported as a change.
+
+    Attributes:
+        baseline (BenchmarkResult): The baseline result.
+        candidate (BenchmarkResult): The candidate result.
+        threshold (float): Relative difference of medians that is ignored.
+    """
+
+    baseline: BenchmarkResult
+    candidate: BenchmarkResult
+    threshold: float = DEFAULT_THRESHOLD
+
+    def __str__(self) -> str:
+        return (
+            f"{self.candidate.name}: {_format_seconds(self.baseline.median)} -> "
+            f"{_format_seconds(self.candidate.median)} (x{self.ratio:.2f}, {self.verdict})"
+        )
+
+    @property
+    def ratio(self) -> float:
+        """The ratio of candidate median to baseline median, above 1 if candidate is slower.
+
+        If the baseline median is 0, e.g. below the clock resolution, the ratio
+        is 1 for a zero candidate median too, and infinity otherwise.
+        """
+        if not self.baseline.median:
+            return 1.0 if not self.candidate.median else math.inf
+        return self.candidate.median / self.baseline.median
+
+    @property
+    def verdict(self) -> Verdict:
+        """Whether the candidate is faster, slower or the same as the baseline."""
+        if self.ratio > 1 + self.threshold and self.candidate.q1 > self.baseline.q3:
+            return "slower"
+        if self.ratio < 1 - self.threshold and self.candidate.q3 < self.baseline.q1:
+            return "faster"
+        return "same"
+
+    @property
+    def regression(self) -> bool:
+        """Whether the candidate is slower than the baseline."""
+        return self.verdict == "slower"
+
+
+def benchmark(
+    func: Callable[[], t.Any],
+    *,
+    name: str | None = None,
+    rounds: int = DEFAULT_ROUNDS,
+    warmup: int = DEFAULT_WARMUP_ROUNDS,
+    round_time: float = DEFAULT_ROUND_TIME,
+    iterations: int | None = None,
+    clock: ClockName | Clock = "perf_counter",
+) -> BenchmarkResult:
+    """
+    Measures the time of calling a function.
+
+    The function is called in rounds of the same number of iterations, which
+    is calibrated so a round takes at least ``round_time``, so timings of fast
+    functions are not lost in the clock resolution. Calibration and then
+    ``warmup`` rounds are not measured, they give caches, memory allocators
+    and lazy imports time to settle.
+
+    Args:
+        func (Callable[[], t.Any]): The function to measure, use
+            :func:`functools.partial` to pass arguments.
+        name (str | None): Name of the benchmark. Defaults to the qualified
+            name of the function, or the function wrapped with
+            :func:`functools.partial`.
+        rounds (int): Number of measured rounds, at least 2. Defaults to 20.
+        warmup (int): Number of rounds to run before measuring. Defaults to 3.
+        round_time (float): Minimal time of a round in seconds, used for
+            calibration. Defaults to 0.05.
+        iterations (int | None): Number of calls per round, calibrated if not
+            given. Defaults to None.
+        clock (ClockName | Clock): The clock to measure time with. Defaults to
+            ``"perf_counter"``.
+
+    Returns:
+        BenchmarkResult: Timings of measured rounds.
+
+    Raises:
+        ValueError: If there are less than 2 rounds, or less than 1 iteration.
+
+    Examples:
+        Measuring a function call::
+
+            result = benchmark(partial(fmt.size, 123456789))
+            print(result)
+            # Output: size: 312.45 ns (IQR 4.20 ns, 20x160256)
+    """
+    if rounds < 2:
+        raise ValueError(f"At least 2 rounds are needed, got {rounds}")
+    if iterations is not None and iterations < 1:
+        raise ValueError(f"At least 1 iteration is needed, got {iterations}")
+    timer = Timer(clock=clock)
+    iterations = iterations or _calibrate(func, timer, round_time)
+    _run_rounds(func, timer, iterations, warmup)
+    laps = _run_rounds(func, timer, iterations, rounds)
+    timings = tuple(lap / NS_PER_SECOND / iterations for lap in laps)
+    return BenchmarkResult(name or _func_name(func), iterations, timings)
+
+
+def compare(
+    baseline: BenchmarkResult,
+    candidate: BenchmarkResult,
+    threshold: float = DEFAULT_THRESHOLD,
+) -> Comparison:
+    """
+    Compares a candidate benchmark result with a baseline one.
+
+    Args:
+        baseline (BenchmarkResult): The baseline result.
+        candidate (BenchmarkResult): The candidate result.
+        threshold (float): Relative difference of medians to ignore.
+            Defaults to 0.05.
+
+    Returns:
+        Comparison: The comparison, see :attr:`Comparison.verdict`.
+    """
+    return Comparison(baseline, candidate, threshold)
+
+
+def compare_funcs(
+    baseline: Callable[[], t.Any],
+    candidate: Callable[[], t.Any],
+    threshold: float = DEFAULT_THRESHOLD,
+    **kwargs: t.Any,
+) -> Comparison:
+    """
+    Benchmarks two functions and compares them.
+
+    Both functions run the same number of iterations per round, calibrated
+    for the baseline.
+
+    Args:
+        baseline (Callable[[], t.Any]): The baseline function.
+        candidate (Callable[[], t.Any]): The candidate function.
+        threshold (float): Relative difference of medians to ignore.
+            Defaults to 0.05.
+        **kwargs: Keyword arguments of :func:`benchmark`.
+
+    Returns:
+        Comparison: The comparison, see :attr:`Comparison.verdict`.
+
+    Examples:
+        Checking an optimization::
+
+            comparison = compare_funcs(partial(old_idfy, users), partial(idfy, users))
+            print(comparison)
+            # Output: idfy: 8.12 ms -> 3.40 ms (x0.42, faster)
+    """
+    baseline_result = benchmark(baseline, **kwargs)
+    kwargs.setdefault("iterations", baseline_result.iterations)
+    return Comparison(baseline_result, benchmark(candidate, **kwargs), threshold)
+
+
+def save(results: Iterable[BenchmarkResult], path: str | os.PathLike[str]) -> None:
+    """
+    Saves benchmark results to a JSON file.
+
+    Args:
+        results (Iterable[BenchmarkResult]): The results to save.
+        path (str | os.PathLike[str]): Path to the file.
+    """
+    data = {"results": [result.to_dict() for result in results]}
+    Path(path).write_text(json.dumps(data, indent=2), encoding="utf-8")
+
+
+def load(path: str | os.PathLike[str]) -> dict[str, BenchmarkResult]:
+    """
+    Loads benchmark results saved with :func:`save`.
+
+    Args:
+        path (str | os.PathLike[str]): Path to the file.
+
+    Returns:
+        dict[str, BenchmarkResult]: Results by name.
+
+    Raises:
+        ValueError: If the file is not a valid results file.
+    """
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        results = [BenchmarkResult.from_dict(item) for item in data["results"]]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid benchmark results file {path}") from e
+    return {result.name: result for result in results}
+
+
+def compare_files(
+    baseline: str | os.PathLike[str],
+    candidate: str | os.PathLike[str],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> dict[str, Comparison]:
+    """
+    Compares benchmark results saved to files, by name.
+
+    Args:
+        baseline (str | os.PathLike[str]): Path to the baseline results.
+        candidate (str | os.PathLike[str]): Path to the candidate results.
+        threshold (float): Relative difference of medians to ignore.
+            Defaults to 0.05.
+
+    Returns:
+        dict[str, Comparison]: Comparisons of results present in both files.
+
+    Examples:
+        Failing a CI job on regressions::
+
+            comparisons = compare_files("baseline.json", "current.json")
+            regressions = [str(c) for c in comparisons.values() if c.regression]
+            assert not regressions, regressions
+    """
+    baseline_results, candidate_results = load(baseline), load(candidate)
+    return {
+        name: Comparison(baseline_results[name], result, threshold)
+        for name, result in candidate_results.items()
+        if name in baseline_results
+    }
+
+
+def _calibrate(func: Callable[[], t.Any], timer: Timer, round_time: float) -> int:
+    """Finds the number of iterations for a round to take at least ``round_time``."""
+    round_ns = round_time * NS_PER_SECOND
+    iterations = 1
+    while True:
+        elapsed_ns = _run_rounds(func, timer, iterations, 1)[0]
+        if elapsed_ns >= round_ns / 2:
+            return max(iterations, math.ceil(iterations * round_ns / elapsed_ns))
+        growth = round_ns / elapsed_ns if elapsed_ns else _MAX_CALIBRATION_GROWTH
+        iterations = math.ceil(iterations * min(max(growth, 2), _MAX_CALIBRATION_GROWTH))
+
+
+def _run_rounds(func: Callable[[], t.Any], timer: Timer, iterations: int, rounds: int) -> list[int]:
+    loop = range(iterations)
+    with timer:
+        for _ in range(rounds):
+            for _ in loop:
+                func()
+            timer.lap()
+    return list(timer.laps)
+
+
+def _func_name(func: Callable[..., t.Any]) -> str:
+    while isinstance(func, functools.partial):
+        func = func.func
+    return str(getattr(func, "__qualname__", repr(func)))
+
+
+def _format_seconds(seconds: float) -> str:
+    for scale, unit in _TIME_UNITS:
+        if abs(seconds) >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.2f} ns"
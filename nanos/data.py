@@ -1,29 +1,432 @@
+import abc
+import asyncio
+import codecs
+import concurrent.futures as cf
+import io
+import itertools
+import json
+import operator
+import os
+import re
+import sys
 import typing as t
-from collections.abc import Sequence
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Generator,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Sequence,
+)
+from copy import copy as shallow_copy
+from dataclasses import dataclass
 from functools import partial
+from operator import attrgetter, itemgetter
+
+from nanos.time import Timer
 
 T = t.TypeVar("T")
 K = t.TypeVar("K")
+R = t.TypeVar("R")
 
 DEFAULT_ID_ATTR_NAME: t.Final[str] = "id"
 
+_EXHAUSTED: t.Final = object()
+
+#: Field name, tuple of field names for a composite key, or a function returning the key
+KeySpec = str | Sequence[str] | Callable[[t.Any], t.Any]
+
+#: How to handle items with equal keys: raise :py:exc:`ValueError`, keep the
+#: first or the last item
+DuplicatePolicy = t.Literal["error", "first", "last"]
+
 #: List of values that are considered empty
 EMPTY_VALUES: t.Final[list[t.Any]] = ["", None, [], {}]
 
 
-def chunker(seq: Sequence[T], size: int) -> list[Sequence[T]]:
+#: Function that returns weight of an item, e.g. ``len`` of a serialized record
+Weigher = Callable[[T], float]
+
+
+def chunker(
+    seq: Sequence[T], size: int, *, weight: Weigher[T] | None = None, pack: bool = False
+) -> list[Sequence[T]]:
     """Splits provided iterable into list of chunks of given size
 
+    If ``weight`` function is given, ``size`` is treated as a budget: items are
+    greedily added to a chunk while the total weight of the chunk stays within
+    the budget. With ``pack`` set, items are distributed between chunks using
+    first-fit decreasing bin packing, which produces fewer chunks at the cost
+    of not preserving the order of items.
+
+    An item heavier than the budget is put into a chunk of its own.
+
     Args:
         seq: iterable to split
-        size: chunk size
+        size: chunk size, or weight budget of a chunk if ``weight`` is given
+        weight: function returning weight of an item, defaults to `None`
+        pack: use bin packing to distribute weighted items, defaults to `False`
+
+    Raises:
+        ValueError: if ``pack`` is requested without ``weight``
 
     Returns:
         list of chunks
     """
+    if pack:
+        if weight is None:
+            raise ValueError("Bin packing requires weight function")
+        return list(_pack_weighted(seq, size, weight))
+    if weight is not None:
+        return list(_iter_weighted(iter(seq), size, weight))
     return [seq[pos : pos + size] for pos in range(0, len(seq), size)]
 
 
+@t.overload
+def ichunker(
+    iterable: Iterable[T],
+    size: int,
+    *,
+    views: t.Literal[False] = False,
+    weight: Weigher[T] | None = None,
+) -> Iterator[list[T]]: ...
+
+
+@t.overload
+def ichunker(iterable: t.Any, size: int, *, views: t.Literal[True]) -> Iterator[t.Any]: ...
+
+
+def ichunker(
+    iterable: t.Any, size: int, *, views: bool = False, weight: Weigher[t.Any] | None = None
+) -> Iterator[t.Any]:
+    """Lazily splits provided iterable into chunks of given size.
+
+    Unlike :func:`chunker` accepts any iterable (generators, DB cursors, files)
+    and yields chunks one at a time, so only a single chunk is kept in memory.
+
+    When ``views`` is set, input must be a sequence: bytes-like objects and
+    arrays are sliced through :py:class:`memoryview` without copying, other
+    sequences are sliced lazily.
+
+    If ``weight`` function is given, ``size`` is treated as a weight budget of
+    a chunk, same as in :func:`chunker`.
+
+    Args:
+        iterable: iterable to split
+        size: chunk size, or weight budget of a chunk if ``weight`` is given
+        views: yield slices of the input instead of lists, defaults to `False`
+        weight: function returning weight of an item, defaults to `None`
+
+    Raises:
+        ValueError: if ``size`` is not positive or ``views`` are combined
+            with ``weight``
+        TypeError: if ``views`` is requested for a non-sequence input
+
+    Returns:
+        iterator over chunks
+    """
+    if size <= 0:
+        raise ValueError(f"Chunk size must be positive, got {size}")
+    if views and weight is not None:
+        raise ValueError("Weighted chunking can't produce views")
+    if views:
+        return _iter_views(iterable, size)
+    if weight is not None:
+        return _iter_weighted(iter(iterable), size, weight)
+    return _iter_lists(iter(iterable), size)
+
+
+def _iter_lists(iterator: Iterator[T], size: int) -> Iterator[list[T]]:
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _iter_views(seq: t.Any, size: int) -> Iterator[t.Any]:
+    try:
+        seq = memoryview(seq)
+    except TypeError:
+        if not isinstance(seq, Sequence):
+            raise TypeError(
+                f"Can't make views of {type(seq).__name__}, sequence expected"
+            ) from None
+    return (seq[pos : pos + size] for pos in range(0, len(seq), size))
+
+
+def _iter_weighted(iterator: Iterator[T], budget: float, weight: Weigher[T]) -> Iterator[list[T]]:
+    chunk: list[T] = []
+    total = 0.0
+    for item in iterator:
+        item_weight = weight(item)
+        if chunk and total + item_weight > budget:
+            yield chunk
+            chunk, total = [], 0.0
+        chunk.append(item)
+        total += item_weight
+    if chunk:
+        yield chunk
+
+
+def _pack_weighted(items: Iterable[T], budget: float, weight: Weigher[T]) -> list[list[T]]:
+    weighted = sorted(((weight(item), item) for item in items), key=itemgetter(0), reverse=True)
+    bins: list[list[T]] = []
+    loads: list[float] = []
+    for item_weight, item in weighted:
+        for index, load in enumerate(loads):
+            if load + item_weight <= budget:
+                bins[index].append(item)
+                loads[index] += item_weight
+                break
+        else:
+            bins.append([item])
+            loads.append(item_weight)
+    return bins
+
+
+async def achunker(
+    aiterable: AsyncIterable[T], size: int, max_wait: float | None = None
+) -> AsyncIterator[list[T]]:
+    """Splits provided async iterable into chunks of given size.
+
+    A chunk is yielded as soon as it holds ``size`` items. If ``max_wait`` is
+    given, a non-empty chunk is also yielded once ``max_wait`` seconds have
+    passed since its first item arrived, whichever comes first. This way slow
+    producers don't hold items back for too long.
+
+    Args:
+        aiterable: async iterable to split
+        size: maximum chunk size
+        max_wait: maximum time in seconds to wait for a chunk to fill up,
+            defaults to `None` (wait forever)
+
+    Raises:
+        ValueError: if ``size`` is not positive
+
+    Yields:
+        lists of items
+    """
+    if size <= 0:
+        raise ValueError(f"Chunk size must be positive, got {size}")
+    if max_wait is None:
+        chunks = _achunks(aiterable, size)
+    else:
+        chunks = _achunks_with_deadline(aiter(aiterable), size, max_wait)
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _achunks(aiterable: AsyncIterable[T], size: int) -> AsyncIterator[list[T]]:
+    chunk: list[T] = []
+    async for item in aiterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Batcher(t.Generic[T]):
+    """Buffers items of an async iterator until batch is full or deadline passes.
+
+    Item that is awaited when deadline expires is not cancelled, but kept for
+    the next batch, so no items are lost.
+    """
+
+    def __init__(self, iterator: AsyncIterator[T], size: int, max_wait: float) -> None:
+        self.iterator = iterator
+        self.size = size
+        self.max_wait = max_wait
+        self.chunk: list[T] = []
+        self.deadline: float | None = None
+        self.pending: asyncio.Future[T] | None = None
+        self.exhausted = False
+
+    def timeout(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(self.deadline - asyncio.get_running_loop().time(), 0.0)
+
+    async def fill(self) -> list[T]:
+        """Collects items until the batch is ready, returns it and starts a new one."""
+        while not self.exhausted and len(self.chunk) < self.size:
+            if self.pending is None:
+                self.pending = asyncio.ensure_future(anext(self.iterator))
+            done, _ = await asyncio.wait({self.pending}, timeout=self.timeout())
+            if not done:
+                break
+            self.take(self.pending)
+        chunk, self.chunk, self.deadline = self.chunk, [], None
+        return chunk
+
+    def take(self, future: asyncio.Future[T]) -> None:
+        self.pending = None
+        try:
+            item = future.result()
+        except StopAsyncIteration:
+            self.exhausted = True
+            return
+        if not self.chunk:
+            self.deadline = asyncio.get_running_loop().time() + self.max_wait
+        self.chunk.append(item)
+
+    def cancel(self) -> None:
+        if self.pending is not None:
+            self.pending.cancel()
+
+
+async def _achunks_with_deadline(
+    iterator: AsyncIterator[T], size: int, max_wait: float
+) -> AsyncIterator[list[T]]:
+    batcher = _Batcher(iterator, size, max_wait)
+    try:
+        while not batcher.exhausted:
+            if chunk := await batcher.fill():
+                yield chunk
+    finally:
+        batcher.cancel()
+
+
+@dataclass(frozen=True, slots=True)
+class ChunkResult(t.Generic[R]):
+    """Result of processing a single chunk by :func:`chunk_map`.
+
+    Attributes:
+        index (int): position of the chunk in the input
+        result (R): value returned by the mapped function
+        elapsed (float): time in seconds the function took to process the chunk
+    """
+
+    index: int
+    result: R
+    elapsed: float
+
+
+#: Executors that can be requested from :func:`chunk_map` by name
+ExecutorKind = t.Literal["thread", "process", "inline"]
+
+
+def chunk_map(
+    func: Callable[[list[T]], R],
+    iterable: Iterable[T],
+    size: int,
+    *,
+    executor: ExecutorKind | cf.Executor = "thread",
+    max_workers: int | None = None,
+    max_in_flight: int | None = None,
+    ordered: bool = True,
+    weight: Weigher[T] | None = None,
+) -> Iterator[ChunkResult[R]]:
+    """Splits provided iterable into chunks and maps function over them in an executor.
+
+    Input is chunked lazily with :func:`ichunker`, and at most ``max_in_flight``
+    chunks are submitted to the executor at once, so memory usage stays bounded
+    even if results are consumed slower than they are produced.
+
+    Executor can be given by name - ``"thread"`` and ``"process"`` create a pool
+    of ``max_workers`` workers that is shut down once the iteration is over,
+    ``"inline"`` processes chunks one by one in the current thread. An existing
+    :py:class:`concurrent.futures.Executor` can be passed too, it's left running.
+    Note, that for a process pool ``func`` has to be picklable.
+
+    Args:
+        func: function to apply to every chunk
+        iterable: iterable to split
+        size: chunk size, or weight budget of a chunk if ``weight`` is given
+        executor: executor name or instance, defaults to `"thread"`
+        max_workers: number of workers of a created pool, defaults to `None`
+            (executor's default)
+        max_in_flight: maximum number of submitted but not consumed chunks,
+            defaults to twice the number of workers
+        ordered: yield results in input order, otherwise in completion order,
+            defaults to `True`
+        weight: function returning weight of an item, defaults to `None`
+
+    Raises:
+        ValueError: if ``size`` or ``max_in_flight`` is not positive
+
+    Returns:
+        iterator over :class:`ChunkResult` objects
+    """
+    if max_in_flight is not None and max_in_flight <= 0:
+        raise ValueError(f"Number of chunks in flight must be positive, got {max_in_flight}")
+    chunks = enumerate(ichunker(iterable, size, weight=weight))
+    if executor == "inline":
+        return (ChunkResult(index, *_timed_call(func, chunk)) for index, chunk in chunks)
+    if max_in_flight is None:
+        max_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    return _map_in_executor(executor, max_workers, func, chunks, max_in_flight, ordered)
+
+
+def _timed_call(func: Callable[[list[T]], R], chunk: list[T]) -> tuple[R, float]:
+    with Timer() as timer:
+        result = func(chunk)
+    return result, timer.elapsed
+
+
+_InFlight = dict[cf.Future[tuple[R, float]], int]
+
+
+def _map_in_executor(
+    executor: t.Literal["thread", "process"] | cf.Executor,
+    max_workers: int | None,
+    func: Callable[[list[T]], R],
+    chunks: Iterator[tuple[int, list[T]]],
+    limit: int,
+    ordered: bool,
+) -> Iterator[ChunkResult[R]]:
+    pool: cf.Executor
+    if executor == "thread":
+        pool = cf.ThreadPoolExecutor(max_workers)
+    elif executor == "process":
+        pool = cf.ProcessPoolExecutor(max_workers)
+    else:
+        pool = executor
+    in_flight: _InFlight[R] = {}
+    submit = partial(_submit_chunks, pool, func, chunks, limit, in_flight)
+    try:
+        yield from (_collect_ordered if ordered else _collect_completed)(in_flight, submit)
+    finally:
+        if pool is not executor:
+            pool.shutdown(cancel_futures=True)
+
+
+def _submit_chunks(
+    pool: cf.Executor,
+    func: Callable[[list[T]], R],
+    chunks: Iterator[tuple[int, list[T]]],
+    limit: int,
+    in_flight: _InFlight[R],
+) -> None:
+    for index, chunk in itertools.islice(chunks, limit - len(in_flight)):
+        in_flight[pool.submit(_timed_call, func, chunk)] = index
+
+
+def _collect_ordered(
+    in_flight: _InFlight[R], submit: Callable[[], None]
+) -> Iterator[ChunkResult[R]]:
+    submit()
+    while in_flight:
+        future = next(iter(in_flight))
+        index = in_flight.pop(future)
+        result = future.result()
+        submit()
+        yield ChunkResult(index, *result)
+
+
+def _collect_completed(
+    in_flight: _InFlight[R], submit: Callable[[], None]
+) -> Iterator[ChunkResult[R]]:
+    submit()
+    while in_flight:
+        done, _ = cf.wait(in_flight, return_when=cf.FIRST_COMPLETED)
+        results = [ChunkResult(in_flight.pop(future), *future.result()) for future in done]
+        submit()
+        yield from results
+
+
 @t.overload
 def idfy(
     obj: dict[t.Any, t.Any], id_field_name: str = DEFAULT_ID_ATTR_NAME
@@ -42,12 +445,16 @@ def idfy(obj: set[T], id_field_name: str = DEFAULT_ID_ATTR_NAME) -> dict[t.Any,
 def idfy(obj: tuple[T, ...], id_field_name: str = DEFAULT_ID_ATTR_NAME) -> dict[t.Any, T]: ...
 
 
+@t.overload
+def idfy(obj: Iterable[T], id_field_name: str = DEFAULT_ID_ATTR_NAME) -> dict[t.Any, T]: ...
+
+
 @t.overload
 def idfy(obj: T, id_field_name: str = DEFAULT_ID_ATTR_NAME) -> dict[t.Any, T]: ...
 
 
 def idfy(
-    obj: T | list[T] | set[T] | tuple[T, ...] | dict[t.Any, t.Any],
+    obj: T | Iterable[T] | dict[t.Any, t.Any],
     id_field_name: str = DEFAULT_ID_ATTR_NAME,
 ) -> dict[t.Any, T] | dict[t.Any, dict[t.Any, t.Any]]:
     """Converts given object into dict with ``id_field_name`` values as a key
@@ -55,11 +462,15 @@ def idfy(
 
     If given object is a dict this function uses to get value of
     ``id_field_name`` key. If any other object - looks for ``id_field_name``
-    attribute.
+    attribute, even if the object is iterable.
 
     Raises :py:exc:`ValueError` if there's no appropriate id value found.
 
-    Applied recursively if :py:class:`Iterable` is given as an input.
+    If a list, tuple, set or generator, or any other :py:class:`Iterable`
+    (except strings) without ``id_field_name`` attribute is given as an input,
+    its items are indexed in a single pass. The way to get id (key or attribute) is
+    picked once by the first item, items of other kinds (e.g. nested
+    collections) are handled recursively.
 
     Args:
         obj (T): object to convert to dictionary
@@ -74,68 +485,1013 @@ def idfy(
             return {obj[id_field_name]: obj}
         except KeyError as err:
             raise ValueError(f"Can't get '{id_field_name}' key from {obj} dict") from err
-    if isinstance(obj, (list, set, tuple, t.Generator)):
-        return {k: v for d in obj for k, v in idfy(d, id_field_name).items()}
+    if _is_collection(obj, id_field_name):
+        return _idfy_many(iter(obj), id_field_name)
     if hasattr(obj, id_field_name):
-        return {getattr(obj, id_field_name): obj}
+        return {getattr(obj, id_field_name): t.cast(T, obj)}
     raise ValueError(f"Can't get {id_field_name} attribute from {obj}")
 
 
+def _is_collection(obj: object, id_field_name: str) -> t.TypeGuard[Iterable[t.Any]]:
+    # builtin collections and generators are checked first, as their methods (e.g.
+    # index or count) can clash with the id field name; other objects with the id
+    # are records, even if iterable (e.g. pydantic models)
+    if isinstance(obj, _COLLECTION_TYPES):
+        return True
+    if hasattr(obj, id_field_name):
+        return False
+    return isinstance(obj, Iterable) and not isinstance(obj, (str, bytes))
+
+
+_COLLECTION_TYPES: t.Final = (list, tuple, set, frozenset, Generator)
+
+
+def _idfy_many(items: Iterator[t.Any], id_field_name: str) -> dict[t.Any, t.Any]:
+    result: dict[t.Any, t.Any] = {}
+    for item in items:
+        getter = itemgetter if isinstance(item, dict) else attrgetter
+        failed = _idfy_uniform(result, item, items, getter(id_field_name))
+        if failed is _EXHAUSTED:
+            break
+        # item of a different kind, index it on its own and go on with the rest
+        result.update(idfy(failed, id_field_name))
+    return result
+
+
+def _idfy_uniform(
+    result: dict[t.Any, t.Any],
+    item: t.Any,
+    items: Iterator[t.Any],
+    get_id: Callable[[t.Any], t.Any],
+) -> t.Any:
+    """Indexes items while ``get_id`` works for them, returns the item it failed on."""
+    try:
+        result[get_id(item)] = item
+        for item in items:
+            result[get_id(item)] = item
+    except (KeyError, AttributeError, TypeError):
+        return item
+    return _EXHAUSTED
+
+
+def index_by(
+    items: Iterable[T],
+    key: KeySpec = DEFAULT_ID_ATTR_NAME,
+    *,
+    on_duplicate: DuplicatePolicy = "last",
+) -> dict[t.Any, T]:
+    """Builds a unique index of given items in a single pass.
+
+    Key can be a name of the field, a tuple of names for a composite key (the
+    index key is a tuple of values then), or a function that takes an item and
+    returns its key. Like in :func:`idfy`, items that are dicts are accessed by
+    key, other objects - by attribute; the kind is picked by the first item.
+
+    Args:
+        items: items to index
+        key: key specification, defaults to `"id"`
+        on_duplicate: what to do with items having equal keys - raise
+            :py:exc:`ValueError` (`"error"`), keep the `"first"` or the
+            `"last"` one, defaults to `"last"`
+
+    Raises:
+        ValueError: if key can't be found in an item or isn't hashable, or a
+            duplicate is found with `"error"` policy
+
+    Returns:
+        dict with keys as keys and items as values
+    """
+    return _build_index(_INDEXERS[on_duplicate], items, key)
+
+
+def group_by(items: Iterable[T], key: KeySpec) -> dict[t.Any, list[T]]:
+    """Groups given items by key in a single pass.
+
+    Key is specified the same way as for :func:`index_by`. Items in every group
+    keep their original order.
+
+    Args:
+        items: items to group
+        key: key specification
+
+    Raises:
+        ValueError: if key can't be found in an item or isn't hashable
+
+    Returns:
+        dict with keys as keys and lists of items as values
+    """
+    return _build_index(_group, items, key)
+
+
+def _key_getter(key: KeySpec, sample: t.Any) -> Callable[[t.Any], t.Any]:
+    """Makes a function that extracts key from objects like ``sample``."""
+    if callable(key):
+        return key
+    fields = (key,) if isinstance(key, str) else tuple(key)
+    get = (itemgetter if isinstance(sample, Mapping) else attrgetter)(*fields)
+    if len(fields) == 1 and not isinstance(key, str):
+        return lambda item: (get(item),)
+    return get
+
+
+class IndexedCollection(Mapping[t.Any, T]):
+    """Collection of items indexed by key, that is kept up to date on changes.
+
+    Works as a read-only mapping of keys to items (like result of :func:`idfy`),
+    changes are made with :meth:`upsert`, :meth:`upsert_many` and
+    :meth:`remove`, and cost only the changed items, not a rebuild of the
+    whole index.
+
+    Optional secondary indexes group items by other keys and are queried with
+    :meth:`lookup`. Keys are specified the same way as for :func:`index_by`.
+
+        >>> users = IndexedCollection(indexes={"by_org": "org"})
+        >>> users.upsert_many([{"id": 1, "org": "a"}, {"id": 2, "org": "a"}])
+        >>> users[1]
+        {'id': 1, 'org': 'a'}
+        >>> users.lookup("by_org", "a")
+        [{'id': 1, 'org': 'a'}, {'id': 2, 'org': 'a'}]
+
+    Args:
+        items: initial items, defaults to none
+        key: key specification of the primary index, defaults to `"id"`
+        indexes: mapping of secondary index names to their key specifications,
+            defaults to `None`
+    """
+
+    def __init__(
+        self,
+        items: Iterable[T] = (),
+        key: KeySpec = DEFAULT_ID_ATTR_NAME,
+        indexes: Mapping[str, KeySpec] | None = None,
+    ) -> None:
+        self.key = key
+        self.index_keys = dict(indexes or {})
+        self._items: dict[t.Any, T] = {}
+        self._indexes: dict[str, dict[t.Any, dict[t.Any, T]]] = {
+            name: {} for name in self.index_keys
+        }
+        # secondary keys of every item, so that they can be unindexed after
+        # the item has been modified in place
+        self._secondary_keys: dict[t.Any, tuple[t.Any, ...]] = {}
+        self._getters: list[Callable[[t.Any], t.Any]] = []
+        self.upsert_many(items)
+
+    def __getitem__(self, key: t.Any) -> T:
+        return self._items[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._items
+
+    def __iter__(self) -> Iterator[t.Any]:
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __repr__(self) -> str:
+        return f"<IndexedCollection [key={self.key!r}, items={len(self)}]>"
+
+    def upsert(self, item: T) -> None:
+        """Adds the item, or replaces an item with the same key.
+
+        Args:
+            item: item to add
+
+        Raises:
+            ValueError: if key can't be found in the item, or it's not hashable
+        """
+        if not self._getters:
+            self._getters = self._make_getters(item)
+        try:
+            keys = tuple(get_key(item) for get_key in self._getters)
+            # unhashable keys fail here, before the collection is changed
+            hash(keys)
+        except (KeyError, AttributeError, TypeError) as err:
+            raise ValueError(f"Can't get key from {item}: {err}") from err
+        primary_key, secondary_keys = keys[0], keys[1:]
+        if primary_key in self._items:
+            self._unindex(primary_key)
+        self._items[primary_key] = item
+        if secondary_keys:
+            self._index(primary_key, item, secondary_keys)
+
+    def upsert_many(self, items: Iterable[T]) -> None:
+        """Adds or replaces all given items, see :meth:`upsert`.
+
+        Args:
+            items: items to add
+        """
+        for item in items:
+            self.upsert(item)
+
+    def remove(self, key: t.Any) -> T:
+        """Removes item by its key.
+
+        Args:
+            key: key of the item
+
+        Raises:
+            KeyError: if there's no item with given key
+
+        Returns:
+            removed item
+        """
+        if key not in self._items:
+            raise KeyError(key)
+        self._unindex(key)
+        return self._items.pop(key)
+
+    def lookup(self, index_name: str, key: t.Any) -> list[T]:
+        """Gets items from the secondary index.
+
+        Args:
+            index_name: name of the index
+            key: key to look for
+
+        Raises:
+            KeyError: if there's no index with given name
+
+        Returns:
+            list of items with given key, empty if there are none
+        """
+        return list(self._indexes[index_name].get(key, {}).values())
+
+    def _make_getters(self, sample: T) -> list[Callable[[t.Any], t.Any]]:
+        specs = [self.key, *self.index_keys.values()]
+        return [_key_getter(spec, sample) for spec in specs]
+
+    def _index(self, primary_key: t.Any, item: T, secondary_keys: tuple[t.Any, ...]) -> None:
+        self._secondary_keys[primary_key] = secondary_keys
+        for index, secondary_key in zip(self._indexes.values(), secondary_keys, strict=True):
+            index.setdefault(secondary_key, {})[primary_key] = item
+
+    def _unindex(self, primary_key: t.Any) -> None:
+        secondary_keys = self._secondary_keys.pop(primary_key, ())
+        for index, secondary_key in zip(self._indexes.values(), secondary_keys, strict=True):
+            bucket = index[secondary_key]
+            del bucket[primary_key]
+            if not bucket:
+                del index[secondary_key]
+
+
+_Indexer = Callable[[Iterable[t.Any], Callable[[t.Any], t.Any]], dict[t.Any, t.Any]]
+
+
+def _build_index(indexer: _Indexer, items: Iterable[t.Any], key: KeySpec) -> dict[t.Any, t.Any]:
+    iterator = iter(items)
+    first = next(iterator, _EXHAUSTED)
+    if first is _EXHAUSTED:
+        return {}
+    # TypeError is raised for items that can't be subscripted (e.g. None) or unhashable keys
+    try:
+        return indexer(itertools.chain((first,), iterator), _key_getter(key, first))
+    except (KeyError, AttributeError, TypeError) as err:
+        raise ValueError(f"Can't get {key} key from an item: {err}") from err
+
+
+def _index_last(items: Iterable[T], get_key: Callable[[T], t.Any]) -> dict[t.Any, T]:
+    return {get_key(item): item for item in items}
+
+
+def _index_first(items: Iterable[T], get_key: Callable[[T], t.Any]) -> dict[t.Any, T]:
+    result: dict[t.Any, T] = {}
+    for item in items:
+        result.setdefault(get_key(item), item)
+    return result
+
+
+def _index_unique(items: Iterable[T], get_key: Callable[[T], t.Any]) -> dict[t.Any, T]:
+    result: dict[t.Any, T] = {}
+    for item in items:
+        item_key = get_key(item)
+        if item_key in result:
+            raise ValueError(f"Duplicate key {item_key!r}")
+        result[item_key] = item
+    return result
+
+
+def _group(items: Iterable[T], get_key: Callable[[T], t.Any]) -> dict[t.Any, list[T]]:
+    result: dict[t.Any, list[T]] = {}
+    for item in items:
+        item_key = get_key(item)
+        group = result.get(item_key)
+        if group is None:
+            result[item_key] = [item]
+        else:
+            group.append(item)
+    return result
+
+
+_INDEXERS: t.Final[dict[str, _Indexer]] = {
+    "error": _index_unique,
+    "first": _index_first,
+    "last": _index_last,
+}
+
+
+#: Function that tells whether a value is empty
+EmptyPredicate = Callable[[t.Any], bool]
+
+
 @t.overload
 def remove_empty_members(
-    obj: dict[t.Any, t.Any], empty: list[t.Any] | None = None
+    obj: dict[t.Any, t.Any],
+    empty: list[t.Any] | None = None,
+    *,
+    copy: bool = False,
+    predicate: EmptyPredicate | None = None,
 ) -> dict[t.Any, t.Any] | None: ...
 
 
 @t.overload
 def remove_empty_members(
-    obj: list[t.Any], empty: list[t.Any] | None = None
+    obj: list[t.Any],
+    empty: list[t.Any] | None = None,
+    *,
+    copy: bool = False,
+    predicate: EmptyPredicate | None = None,
 ) -> list[t.Any] | None: ...
 
 
 @t.overload
-def remove_empty_members(obj: T, empty: list[t.Any] | None = None) -> T | None: ...
+def remove_empty_members(
+    obj: T,
+    empty: list[t.Any] | None = None,
+    *,
+    copy: bool = False,
+    predicate: EmptyPredicate | None = None,
+) -> T | None: ...
 
 
-def remove_empty_members(obj: T, empty: list[t.Any] | None = None) -> T | None:
+def remove_empty_members(
+    obj: T,
+    empty: list[t.Any] | None = None,
+    *,
+    copy: bool = False,
+    predicate: EmptyPredicate | None = None,
+) -> T | None:
     """Removes empty members from given object.
 
-    Recursively goes through the given object and removes its members that are
-    considered empty. If given object is a dict, removes keys that have empty
-    values. If given object is a list removes empty items from it.
+    Goes through the given object and removes its members that are considered
+    empty, nested containers are cleaned first. If given object is a mapping,
+    removes keys that have empty values. If given object is a list, tuple or
+    set removes empty items from it. Other objects (including named tuples) are
+    left as is.
+
+    There's no limit on nesting depth: deeply nested containers are traversed
+    with an explicit stack instead of recursion.
+
+    Only values considered empty are removed: with custom ``empty`` values,
+    ``None`` is kept unless it's one of them. Version 0.1.9 and earlier removed
+    ``None`` values of dicts anyway, and replaced empty items of lists with
+    ``None`` instead of removing them.
+
+    By default mutable containers (dicts, lists, sets and other mutable
+    mappings) are cleaned in place, tuples are rebuilt, and immutable mappings
+    (e.g. :class:`types.MappingProxyType`) are rebuilt as dicts.
+    With ``copy`` set, given object is not modified and cleaned copies of the
+    containers are returned.
 
     Args:
         obj: object to remove empty members from
         empty: list of values that are considered empty. If not given, defaults to
             :const:`EMPTY_VALUES`
+        copy: leave given object intact and return a cleaned copy, defaults
+            to `False`
+        predicate: function that tells whether a value is empty, in addition
+            to ``empty`` values, defaults to `None`
 
     Returns:
         object with empty members removed, or None if the object itself is empty
     """
-    empty = empty or EMPTY_VALUES
-    cleaners: dict[type, t.Callable[[t.Any, list[t.Any]], t.Any]]
-    cleaners = {
-        dict: _remove_empty_members_from_dict,
-        list: _remove_empty_members_from_list,
-    }
-    if (cleaner := cleaners.get(type(obj))) is not None:
-        obj = cleaner(obj, empty)
-    if obj in empty:
+    if empty or predicate is not None:
+        is_empty = _EmptyCheck(empty or EMPTY_VALUES, predicate)
+    else:
+        is_empty = _DEFAULT_EMPTY_CHECK
+    obj = _Cleaner(is_empty, copy).clean(obj)
+    if is_empty(obj):
         return None
     return obj
 
 
-def _remove_empty_members_from_dict(
-    obj: dict[t.Any, t.Any], empty: list[t.Any]
-) -> dict[t.Any, t.Any]:
-    for key in list(obj.keys()):
-        obj[key] = remove_empty_members(obj[key], empty)
-        if obj[key] is None:
-            del obj[key]
-    return obj
+class _EmptyCheck:
+    """Precompiled check whether a value equals to any of the empty values.
+
+    Values of built-in scalar types are checked by membership in a set of
+    hashable empty values. For other types a check is composed once per type,
+    e.g. for lists it's enough to check their length if ``[]`` is considered
+    empty, and there's no need to compare them with strings.
+    """
+
+    def __init__(self, empty: Iterable[t.Any], predicate: EmptyPredicate | None = None) -> None:
+        hashable: list[t.Any] = []
+        unhashable: list[t.Any] = []
+        for value in empty:
+            (unhashable if type(value).__hash__ is None else hashable).append(value)
+        self.sentinels = frozenset(hashable)
+        self.unhashable = tuple(unhashable)
+        self.predicate = predicate
+        # these types can't be equal to an unhashable value, so set lookup is enough
+        self.scalar_types = _SCALAR_TYPES if predicate is None else frozenset()
+        self._checks: dict[type, EmptyPredicate] = {}
+        # types, which values are empty if and only if they are falsy
+        self.falsy_types = frozenset(
+            cls for cls in (dict, list) if self._compile(cls) is operator.not_
+        )
+        self.specs = (self.scalar_types, self.sentinels, self.falsy_types)
+
+    def __call__(self, value: t.Any) -> bool:
+        check = self._checks.get(type(value))
+        if check is None:
+            check = self._checks[type(value)] = self._compile(type(value))
+        return check(value)
+
+    def _compile(self, cls: type) -> EmptyPredicate:
+        checks: list[EmptyPredicate] = []
+        if cls.__hash__ is not None and self.sentinels:
+            checks.append(self._is_sentinel)
+        checks.extend(_equality_check(cls, value) for value in self.unhashable)
+        if self.predicate is not None:
+            checks.append(self.predicate)
+        return _any_of(checks)
+
+    def _is_sentinel(self, value: t.Any) -> bool:
+        try:
+            return value in self.sentinels
+        except TypeError:  # e.g. tuple with a list inside
+            return False
+
+
+_SCALAR_TYPES: t.Final = frozenset({str, bytes, int, float, complex, bool, type(None)})
+
+
+def _equality_check(cls: type, empty_value: t.Any) -> EmptyPredicate:
+    # lists are equal only to lists, mappings - only to mappings
+    for kind in (list, Mapping):
+        if isinstance(empty_value, kind) and not issubclass(cls, kind):
+            return _never
+        if isinstance(empty_value, kind) and not empty_value:
+            return operator.not_
+    return partial(operator.eq, empty_value)
+
+
+def _any_of(checks: list[EmptyPredicate]) -> EmptyPredicate:
+    checks = [check for check in checks if check is not _never]
+    if not checks:
+        return _never
+    if len(checks) == 1:
+        return checks[0]
+    return lambda value: any(check(value) for check in checks)
+
+
+def _never(value: t.Any) -> bool:
+    return False
+
+
+_DEFAULT_EMPTY_CHECK: t.Final = _EmptyCheck(EMPTY_VALUES)
+
+
+#: Containers nested deeper are cleaned without recursion
+_MAX_RECURSION_DEPTH: t.Final = 64
+
+
+class _Cleaner:
+    """Removes empty members from nested containers.
+
+    Plain dicts and lists are cleaned recursively, as it's the fastest way to
+    go through them. Deeply nested ones, and containers of other types, are
+    cleaned with an explicit stack of frames, so nesting depth is not limited.
+    """
+
+    def __init__(self, is_empty: _EmptyCheck, copy: bool) -> None:
+        self.is_empty = is_empty
+        self.copy = copy
+        self.cleaners: dict[type, Callable[[t.Any, int], t.Any]] = {
+            dict: self._clean_dict,
+            list: self._clean_list,
+        }
+
+    def clean(self, obj: t.Any, depth: int = 0) -> t.Any:
+        return (self.cleaners.get(type(obj)) or self._clean_deep)(obj, depth)
+
+    def _clean_deep(self, obj: t.Any, depth: int) -> t.Any:
+        if (frame_type := _frame_type(obj)) is None:
+            return obj
+        return _clean_container(frame_type(obj), self.is_empty, self.copy)
+
+    def _clean_dict(self, obj: dict[t.Any, t.Any], depth: int) -> dict[t.Any, t.Any]:
+        is_empty = self.is_empty
+        scalar_types, sentinels, falsy_types = is_empty.specs
+        clean_deep = self._clean_deep
+        cleaners = self.cleaners if depth < _MAX_RECURSION_DEPTH else {}
+        kept = {}
+        for key, value in obj.items():
+            if type(value) in scalar_types:
+                if value not in sentinels:
+                    kept[key] = value
+                continue
+            value = (cleaners.get(type(value)) or clean_deep)(value, depth + 1)
+            if value if type(value) in falsy_types else not is_empty(value):
+                kept[key] = value
+        return kept if self.copy else _replace_items(obj, kept)
+
+    def _clean_list(self, obj: list[t.Any], depth: int) -> list[t.Any]:
+        is_empty = self.is_empty
+        scalar_types, sentinels, falsy_types = is_empty.specs
+        clean_deep = self._clean_deep
+        cleaners = self.cleaners if depth < _MAX_RECURSION_DEPTH else {}
+        kept = []
+        for value in obj:
+            if type(value) in scalar_types:
+                if value not in sentinels:
+                    kept.append(value)
+                continue
+            value = (cleaners.get(type(value)) or clean_deep)(value, depth + 1)
+            if value if type(value) in falsy_types else not is_empty(value):
+                kept.append(value)
+        return kept if self.copy else _replace_values(obj, kept)
+
+
+def _clean_container(frame: "_Frame", is_empty: _EmptyCheck, copy: bool) -> t.Any:
+    stack: list[_Frame] = []
+    while True:
+        child = frame.advance(is_empty)
+        if child is not None:
+            stack.append(frame)
+            frame = child
+            continue
+        cleaned = frame.build(copy)
+        if not stack:
+            return cleaned
+        frame = stack.pop()
+        if not is_empty(cleaned):
+            frame.kept[frame.key] = cleaned
+
+
+class _Frame(abc.ABC):
+    """Cleaning state of a container on the stack of :func:`remove_empty_members`.
+
+    Kept children are collected into a dict by their keys (indices for
+    sequences), so that containers of all kinds are handled the same way.
+    """
+
+    __slots__ = ("obj", "children", "kept", "key")
+
+    def __init__(self, obj: t.Any) -> None:
+        self.obj = obj
+        self.children: Iterator[tuple[t.Any, t.Any]] = enumerate(obj)
+        self.kept: dict[t.Any, t.Any] = {}
+        self.key: t.Any = None
+
+    def advance(self, is_empty: _EmptyCheck) -> "_Frame | None":
+        """Keeps non-empty children until a nested container is met.
+
+        Returns:
+            frame of the nested container, or None if all children are processed
+        """
+        kept, scalar_types, sentinels = self.kept, is_empty.scalar_types, is_empty.sentinels
+        for key, value in self.children:
+            is_scalar = type(value) in scalar_types
+            if is_scalar and value in sentinels:
+                continue
+            if not is_scalar and (frame_type := _frame_type(value)) is not None:
+                self.key = key
+                return frame_type(value)
+            if is_scalar or not is_empty(value):
+                kept[key] = value
+        return None
+
+    @abc.abstractmethod
+    def build(self, copy: bool) -> t.Any:
+        """Makes the cleaned container out of kept children."""
+
+
+class _ListFrame(_Frame):
+    __slots__ = ()
+
+    def build(self, copy: bool) -> t.Any:
+        values = list(self.kept.values())
+        if copy and type(self.obj) is list:
+            return values
+        target = shallow_copy(self.obj) if copy else self.obj
+        target[:] = values
+        return target
+
+
+class _TupleFrame(_Frame):
+    __slots__ = ()
+
+    def build(self, copy: bool) -> t.Any:
+        return tuple(self.kept.values())
+
+
+class _SetFrame(_Frame):
+    __slots__ = ()
+
+    def build(self, copy: bool) -> t.Any:
+        if isinstance(self.obj, frozenset):
+            return type(self.obj)(self.kept.values())
+        target = shallow_copy(self.obj) if copy else self.obj
+        target.clear()
+        target.update(self.kept.values())
+        return target
+
+
+class _MappingFrame(_Frame):
+    __slots__ = ()
+
+    def __init__(self, obj: Mapping[t.Any, t.Any]) -> None:
+        self.obj = obj
+        self.children = iter(obj.items())
+        self.kept = {}
+        self.key = None
+
+    def build(self, copy: bool) -> t.Any:
+        if type(self.obj) is dict:
+            return self.kept if copy else _replace_items(self.obj, self.kept)
+        # immutable mappings can't be cleaned in place, so they're rebuilt as dicts
+        if not isinstance(self.obj, MutableMapping):
+            return self.kept
+        return _replace_items(shallow_copy(self.obj) if copy else self.obj, self.kept)
+
+
+def _replace_values(target: list[t.Any], values: list[t.Any]) -> list[t.Any]:
+    target[:] = values
+    return target
+
+
+def _replace_items(target: MutableMapping[t.Any, t.Any], items: dict[t.Any, t.Any]) -> t.Any:
+    # when nothing is removed, updating values keeps the order of keys as is
+    if len(target) != len(items):
+        target.clear()
+    target.update(items)
+    return target
 
 
-def _remove_empty_members_from_list(obj: list[t.Any], empty: list[t.Any]) -> list[t.Any]:
-    return list(
-        filter(lambda x: x not in empty, map(partial(remove_empty_members, empty=empty), obj))
+# frame type for every seen type of value, None for values that are not cleaned
+_FRAME_TYPES: dict[type, type[_Frame] | None] = {
+    dict: _MappingFrame,
+    list: _ListFrame,
+    tuple: _TupleFrame,
+    set: _SetFrame,
+    frozenset: _SetFrame,
+    str: None,
+    int: None,
+    float: None,
+    bool: None,
+    type(None): None,
+}
+
+
+def _frame_type(value: t.Any) -> type[_Frame] | None:
+    cls = type(value)
+    try:
+        return _FRAME_TYPES[cls]
+    except KeyError:
+        return _FRAME_TYPES.setdefault(cls, _resolve_frame_type(cls))
+
+
+def _resolve_frame_type(cls: type) -> type[_Frame] | None:
+    # subclasses of tuple (e.g. named tuples) are not cleaned, as their length matters
+    if issubclass(cls, Mapping):
+        return _MappingFrame
+    if issubclass(cls, list):
+        return _ListFrame
+    if issubclass(cls, (set, frozenset)):
+        return _SetFrame
+    return None
+
+
+#: Size of a chunk read from the input stream by :func:`remove_empty_members_stream`
+DEFAULT_STREAM_CHUNK_SIZE: t.Final = 64 * 1024
+
+
+def remove_empty_members_stream(
+    src: t.IO[str] | t.IO[bytes],
+    dst: t.IO[str] | t.IO[bytes],
+    empty: list[t.Any] | None = None,
+    *,
+    predicate: EmptyPredicate | None = None,
+    chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+) -> None:
+    """Removes empty members from JSON document, reading and writing it as a stream.
+
+    Does the same as :func:`remove_empty_members` applied to a loaded
+    document, but the document is never loaded as a whole: it's read by
+    chunks of ``chunk_size``, and cleaned JSON is written to ``dst`` as soon as
+    it's known that a member is not empty. Memory usage depends on the nesting
+    depth of the document and the size of its biggest string, not on the size
+    of the document.
+
+    Output is compact JSON, strings and numbers are copied from the input as
+    is. If the whole document is empty, ``null`` is written.
+
+    Args:
+        src: text or binary (UTF-8) stream to read JSON from
+        dst: text or binary stream to write cleaned JSON to
+        empty: list of values that are considered empty. If not given, defaults to
+            :const:`EMPTY_VALUES`. Only scalars and empty lists/dicts are supported
+        predicate: function that tells whether a scalar value is empty, in
+            addition to ``empty`` values, defaults to `None`
+        chunk_size: size of chunks to read, defaults to 64KiB
+
+    Raises:
+        ValueError: if input is not a valid JSON, or ``empty`` contains non-empty
+            containers
+    """
+    empty = empty or EMPTY_VALUES
+    if any(isinstance(value, (list, dict)) and value for value in empty):
+        raise ValueError("Only scalars and empty containers can be matched in a stream")
+    writer = _JsonWriter(dst, _JsonEmptyCheck(empty, predicate))
+    parser = _JsonCleaner(writer)
+    for kind, text in _iter_json_tokens(src, chunk_size):
+        parser.feed(kind, text)
+    parser.finish()
+    writer.finish()
+
+
+_JSON_TOKEN: t.Final = re.compile(
+    r"""
+    [ \t\n\r]*
+    (?:
+        (?P<punct>[{}\[\]:,])
+      | (?P<string>"[^"\\]*(?:\\.[^"\\]*)*")
+      | (?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?)
+      | (?P<literal>true|false|null)
     )
+    """,
+    re.VERBOSE,
+)
+# characters of a string up to its closing quote, or a backslash that ends the text
+_JSON_STRING_CHARS: t.Final = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+_JSON_LITERALS: t.Final[dict[str, t.Any]] = {"true": True, "false": False, "null": None}
+
+
+def _iter_json_tokens(src: t.IO[t.Any], chunk_size: int) -> Iterator[tuple[str, str]]:
+    """Yields kind and text of JSON tokens, reading source by chunks.
+
+    Kind of punctuation tokens is the token itself.
+    """
+    reader = _ChunkReader(src, chunk_size)
+    tail, held = "", 0
+    while not reader.eof:
+        buffer = _read_json_chunks(reader, tail, held)
+        tokens, consumed, scanned = _split_json_tokens(buffer, reader.eof)
+        yield from tokens
+        tail, held = buffer[consumed:], scanned - consumed
+    if tail.strip(" \t\n\r"):
+        raise ValueError(f"Invalid JSON near {tail[:20]!r}")
+
+
+def _split_json_tokens(buffer: str, final: bool) -> tuple[list[tuple[str, str]], int, int]:
+    """Splits buffer to tokens, returns them with the length of the buffer they take.
+
+    Tokenizing stops at invalid data. The last token is held back unless the
+    buffer is final, as it may continue in the next chunk (e.g. ``1`` of ``1.5``).
+    The length of the buffer scanned, including the held back token, is
+    returned as well.
+    """
+    tokens = []
+    start = end = 0
+    for match in _JSON_TOKEN.finditer(buffer):
+        if match.start() != end:
+            break
+        kind = t.cast(str, match.lastgroup)
+        text = match.group(kind)
+        tokens.append(((text if kind == "punct" else kind), text))
+        start, end = end, match.end()
+    else:
+        start = end if final else start
+    return (tokens if start == end else tokens[:-1]), start, end
+
+
+def _read_json_chunks(reader: "_ChunkReader", tail: str, held: int) -> str:
+    """Reads a chunk, and more until a string unfinished in the tail ends, returns all of them.
+
+    The tail starts with ``held`` characters of a held back token, followed by
+    data that is not tokenized yet. Only new chunks are scanned for the end of
+    the string, so strings much longer than a chunk are read in linear time.
+    """
+    pieces = [tail, reader.read()]
+    rest = tail[held:].lstrip(" \t\n\r")
+    resume = _resume_json_string(rest, 1) if rest.startswith('"') else None
+    while resume is not None and not reader.eof:
+        resume = _resume_json_string(pieces[-1], resume)
+        if resume is not None:
+            pieces.append(reader.read())
+    return "".join(pieces)
+
+
+def _resume_json_string(text: str, pos: int) -> int | None:
+    """Scans text of a string from pos, returns where to resume in the next chunk.
+
+    Returns `None` if the string ends in the text (or is invalid), 1 if the
+    text ends with a backslash, which escapes the first character of the next
+    chunk, 0 otherwise.
+    """
+    end = t.cast(re.Match[str], _JSON_STRING_CHARS.match(text, pos)).end()
+    if end == len(text):
+        return 0
+    if end == len(text) - 1 and text[end] == "\\":
+        return 1
+    return None
+
+
+class _ChunkReader:
+    """Reads text from text or UTF-8 binary stream."""
+
+    def __init__(self, src: t.IO[t.Any], chunk_size: int) -> None:
+        self.src = src
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.eof = False
+
+    def read(self) -> str:
+        chunk = self.src.read(self.chunk_size)
+        self.eof = not chunk
+        if isinstance(chunk, bytes):
+            return self.decoder.decode(chunk, final=self.eof)
+        return t.cast(str, chunk)
+
+
+class _JsonEmptyCheck:
+    """Checks whether JSON scalar is empty, decoding it only when needed."""
+
+    def __init__(self, empty: list[t.Any], predicate: EmptyPredicate | None) -> None:
+        self.is_empty = _EmptyCheck(empty, predicate)
+        strings = [value for value in empty if isinstance(value, str)]
+        # longest possible JSON representation of an empty string, as any
+        # character can be escaped with up to 12 characters (surrogate pair)
+        self.max_string = -1 if not strings else 2 + 12 * max(map(len, strings))
+        # numbers can only be empty when compared to numbers (booleans included)
+        self.numbers = any(isinstance(value, (int, float)) for value in empty)
+        if predicate is not None:
+            self.max_string = sys.maxsize
+            self.numbers = True
+        self.empty_list = self.is_empty([])
+        self.empty_dict = self.is_empty({})
+
+    def __call__(self, kind: str, text: str) -> bool:
+        if kind == "string":
+            return len(text) <= self.max_string and self.is_empty(json.loads(text))
+        if kind == "number":
+            return self.numbers and self.is_empty(json.loads(text))
+        return self.is_empty(_JSON_LITERALS[text])
+
+
+class _JsonFrame:
+    __slots__ = ("opener", "closer", "has_children")
+
+    def __init__(self, opener: str, closer: str) -> None:
+        self.opener = opener
+        self.closer = closer
+        self.has_children = False
+
+
+class _JsonWriter:
+    """Writes cleaned JSON, postponing container openings until they get a member.
+
+    Containers that got no members are dropped, unless empty containers are
+    not considered empty.
+    """
+
+    buffer_size: t.Final = 64 * 1024
+
+    def __init__(self, dst: t.IO[t.Any], is_empty: _JsonEmptyCheck) -> None:
+        self.dst = dst
+        self.encode = not isinstance(dst, io.TextIOBase)
+        self.is_empty = is_empty
+        self.frames: list[_JsonFrame] = []
+        self.written = 0  # number of frames, which openings are written
+        self.buffer: list[str] = []
+        self.buffered = 0
+        self.has_root = False
+
+    def open(self, prefix: str, bracket: str) -> None:
+        self.frames.append(_JsonFrame(prefix + bracket, "}" if bracket == "{" else "]"))
+
+    def close(self) -> None:
+        frame = self.frames.pop()
+        if self.written > len(self.frames):
+            self.written -= 1
+            self._write(frame.closer)
+        elif not (self.is_empty.empty_dict if frame.closer == "}" else self.is_empty.empty_list):
+            self._emit(frame.opener + frame.closer)
+
+    def scalar(self, prefix: str, kind: str, text: str) -> None:
+        if not self.is_empty(kind, text):
+            self._emit(prefix + text)
+
+    def finish(self) -> None:
+        if not self.has_root:
+            self._write("null")
+        self._flush(force=True)
+
+    def _emit(self, text: str) -> None:
+        self._open_frames()
+        if self.frames and self.frames[-1].has_children:
+            text = "," + text
+        self._mark_child()
+        self._write(text)
+
+    def _open_frames(self) -> None:
+        for frame in self.frames[self.written :]:
+            if self.written and self.frames[self.written - 1].has_children:
+                self._write(",")
+            self._mark_child()
+            self._write(frame.opener)
+            self.written += 1
+
+    def _mark_child(self) -> None:
+        if self.written:
+            self.frames[self.written - 1].has_children = True
+        self.has_root = True
+
+    def _write(self, text: str) -> None:
+        self.buffer.append(text)
+        self.buffered += len(text)
+        self._flush()
+
+    def _flush(self, force: bool = False) -> None:
+        if self.buffered < self.buffer_size and not force:
+            return
+        data = "".join(self.buffer)
+        self.dst.write(data.encode() if self.encode else data)
+        self.buffer, self.buffered = [], 0
+
+
+class _JsonCleaner:
+    """Validates the order of JSON tokens and passes cleaned members to the writer.
+
+    Works as a state machine, where state is the handler of the next token,
+    that depends on what kind of token is expected.
+    """
+
+    def __init__(self, writer: _JsonWriter) -> None:
+        self.writer = writer
+        self.brackets: list[str] = []
+        self.prefix = ""  # key of the current object member
+        self.feed: Callable[[str, str], None] = self._on_value
+
+    def finish(self) -> None:
+        if self.feed != self._unexpected:
+            raise ValueError("Invalid JSON: unexpected end of data")
+
+    def _on_value(self, kind: str, text: str) -> None:
+        if kind in ("{", "["):
+            self.writer.open(self.prefix, kind)
+            self.brackets.append(kind)
+            self.prefix = ""
+            self.feed = self._on_key_or_end if kind == "{" else self._on_value_or_end
+            return
+        if kind not in ("string", "number", "literal"):
+            self._unexpected(kind, text)
+        self.writer.scalar(self.prefix, kind, text)
+        self._after_value()
+
+    def _on_value_or_end(self, kind: str, text: str) -> None:
+        if kind == "]":
+            self._close(kind, text)
+        else:
+            self._on_value(kind, text)
+
+    def _on_key(self, kind: str, text: str) -> None:
+        if kind != "string":
+            self._unexpected(kind, text)
+        self.prefix = text + ":"
+        self.feed = self._on_colon
+
+    def _on_key_or_end(self, kind: str, text: str) -> None:
+        if kind == "}":
+            self._close(kind, text)
+        else:
+            self._on_key(kind, text)
+
+    def _on_colon(self, kind: str, text: str) -> None:
+        if kind != ":":
+            self._unexpected(kind, text)
+        self.feed = self._on_value
+
+    def _on_next(self, kind: str, text: str) -> None:
+        if kind != ",":
+            self._close(kind, text)
+        elif self.brackets[-1] == "{":
+            self.feed = self._on_key
+        else:
+            self.feed = self._on_value
+            self.prefix = ""
+
+    def _close(self, kind: str, text: str) -> None:
+        if kind != {"{": "}", "[": "]"}[self.brackets[-1]]:
+            self._unexpected(kind, text)
+        self.brackets.pop()
+        self.writer.close()
+        self._after_value()
+
+    def _after_value(self) -> None:
+        self.feed = self._on_next if self.brackets else self._unexpected
+        self.prefix = ""
+
+    def _unexpected(self, kind: str, text: str) -> t.NoReturn:
+        raise ValueError(f"Invalid JSON: unexpected {text[:20]!r}")
@@ -1,7 +1,172 @@
+import functools
+import re
 import typing as t
+from bisect import bisect_right
+from fractions import Fraction
 
 SIZE_UNIT: t.Final = "B"
 DEFAULT_PRECISION: t.Final = 2
+DEFAULT_PATTERN: t.Final = "{value} {prefix}{unit}"
+
+#: Binary prefixes of units, for powers of 1024
+IEC_PREFIXES: t.Final = ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi", "Yi")
+#: Decimal prefixes of units, for powers of 1000
+SI_PREFIXES: t.Final = ("", "k", "M", "G", "T", "P", "E", "Z", "Y")
+#: Decimal prefixes of units below one, for powers of 1000
+SI_SUBUNIT_PREFIXES: t.Final = ("n", "µ", "m", "")
+
+# A number, optionally signed, with a fraction or a bounded exponent, and a unit
+_SIZE_PATTERN: t.Final = re.compile(
+    r"\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d{1,3})?)\s*([a-z]*)\s*", re.IGNORECASE | re.ASCII
+)
+# Multipliers of lowercase size units, with and without the byte unit
+_SIZE_MULTIPLIERS: t.Final[dict[str, int]] = {
+    f"{prefix}{unit}".lower(): base**power
+    for base, prefixes in ((1000, SI_PREFIXES), (1024, IEC_PREFIXES))
+    for power, prefix in enumerate(prefixes)
+    for unit in ("", SIZE_UNIT)
+}
+
+
+class Formatter:
+    """
+    Formats numbers with the largest unit prefix that keeps them below the base.
+
+    Everything that doesn't depend on the value is prepared once: a format
+    template per prefix, its scale, and thresholds to pick the prefix with a
+    binary search instead of dividing the value in a loop. Create formatters
+    once and reuse them.
+
+    As in :func:`size`, values beyond the largest prefix, infinities and NaN
+    are formatted with the last prefix, and zero with the prefix of one.
+
+    Args:
+        unit (str): The unit to add after the prefix. Defaults to no unit.
+        base (int): The ratio of consecutive prefixes. Defaults to 1024.
+        prefixes (Sequence[str]): Prefixes of the unit, from the smallest.
+            Defaults to :data:`IEC_PREFIXES`.
+        offset (int): The index of the prefix of one in ``prefixes``, prefixes
+            before it are for fractions. Defaults to 0.
+        precision (int): The number of decimal places to round values to.
+            Defaults to 2.
+        pattern (str): The layout of the result with ``{value}``, ``{prefix}``
+            and ``{unit}`` placeholders, trailing spaces are stripped.
+            Defaults to ``"{value} {prefix}{unit}"``.
+
+    Raises:
+        ValueError: If ``base`` is less than 2, ``prefixes`` is empty,
+            ``offset`` is not an index of ``prefixes``, or ``precision`` is
+            negative.
+
+    Examples:
+        >>> requests = Formatter("req/s", base=1000, prefixes=SI_PREFIXES, precision=1,
+        ...                      pattern="{value}{prefix} {unit}")
+        >>> requests(1234)
+        '1.2k req/s'
+    """
+
+    __slots__ = (
+        "unit",
+        "base",
+        "prefixes",
+        "offset",
+        "precision",
+        "pattern",
+        "_units",
+        "_thresholds",
+    )
+
+    def __init__(
+        self,
+        unit: str = "",
+        base: int = 1024,
+        prefixes: t.Sequence[str] = IEC_PREFIXES,
+        offset: int = 0,
+        precision: int = DEFAULT_PRECISION,
+        pattern: str = DEFAULT_PATTERN,
+    ) -> None:
+        if base < 2:
+            raise ValueError(f"Base must be at least 2, got {base}")
+        if not 0 <= offset < len(prefixes):
+            raise ValueError(f"Offset {offset} is not an index of {len(prefixes)} prefixes")
+        if precision < 0:
+            raise ValueError(f"Precision must not be negative, got {precision}")
+        self.unit = unit
+        self.base = base
+        self.prefixes = tuple(prefixes)
+        self.offset = offset
+        self.precision = precision
+        self.pattern = pattern
+        self._units = tuple(
+            (self._template(prefix), float(base) ** (index - offset))
+            for index, prefix in enumerate(self.prefixes)
+        )
+        self._thresholds = tuple(
+            float(base) ** (index - offset + 1) for index in range(len(prefixes) - 1)
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"Formatter(unit={self.unit!r}, base={self.base}, prefixes={self.prefixes!r}, "
+            f"offset={self.offset}, precision={self.precision}, pattern={self.pattern!r})"
+        )
+
+    def __call__(self, value: int | float) -> str:
+        """
+        Formats a number.
+
+        Args:
+            value (int or float): The number to format.
+
+        Returns:
+            str: The number with a unit prefix, e.g. 1.23 MiB.
+        """
+        # Multiplying by 1.0 compares large ints after rounding them, as size() does
+        index = bisect_right(self._thresholds, abs(value * 1.0)) if value else self.offset
+        template, scale = self._units[index]
+        return template % (value / scale)
+
+    def many(self, values: t.Sequence[int | float], out: list[str] | None = None) -> list[str]:
+        """
+        Formats many numbers, as calling the formatter for each would.
+
+        Args:
+            values (Sequence[int | float]): The numbers to format, e.g. a list,
+                an ``array.array`` or a ``memoryview`` of numbers.
+            out (list[str], optional): A preallocated list to write the results
+                to, from its start. Defaults to a new list.
+
+        Returns:
+            list[str]: The results, ``out`` if it was provided.
+
+        Raises:
+            ValueError: If ``out`` is shorter than ``values``.
+        """
+        if out is not None and len(out) < len(values):
+            raise ValueError(f"Output of length {len(out)} is shorter than {len(values)} values")
+        results = [""] * len(values) if out is None else out
+        units, thresholds, offset = self._units, self._thresholds, self.offset
+        for position, value in enumerate(values):
+            template, scale = units[bisect_right(thresholds, abs(value * 1.0)) if value else offset]
+            results[position] = template % (value / scale)
+        return results
+
+    def _template(self, prefix: str) -> str:
+        value = f"%.{self.precision}f"
+        text = self.pattern.format(value="{value}", prefix=prefix, unit=self.unit).rstrip()
+        return text.replace("%", "%%").replace("{value}", value)
+
+
+#: Sizes in bytes with binary prefixes, e.g. 1.50 MiB, as :func:`size`
+IEC_SIZE: t.Final = Formatter(SIZE_UNIT)
+#: Sizes in bytes with decimal prefixes, e.g. 1.50 MB
+SI_SIZE: t.Final = Formatter(SIZE_UNIT, base=1000, prefixes=SI_PREFIXES)
+#: Throughput in bits per second, e.g. 1.50 Gbit/s
+BITRATE: t.Final = Formatter("bit/s", base=1000, prefixes=SI_PREFIXES)
+#: Durations in seconds, e.g. 1.50 ms, longer than a second ones stay in seconds
+DURATION: t.Final = Formatter("s", base=1000, prefixes=SI_SUBUNIT_PREFIXES, offset=3)
+#: Counts with decimal prefixes, e.g. 1.5M
+COUNT: t.Final = Formatter(base=1000, prefixes=SI_PREFIXES, precision=1, pattern="{value}{prefix}")
 
 
 def size(size_bytes: int | float, precision: int = DEFAULT_PRECISION) -> str:
@@ -17,8 +182,75 @@ def size(size_bytes: int | float, precision: int = DEFAULT_PRECISION) -> str:
         str: A human-friendly string representation of the given size,
             e.g. 4.00 B, 1.00 KiB, 1.23 MiB, etc.
     """
-    for unit in ("", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"):
-        if abs(size_bytes) < 1024.0:
-            return f"{size_bytes:.{precision}f} {unit}{SIZE_UNIT}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.{precision}f} Yi{SIZE_UNIT}"
+    return _size_formatter(precision)(size_bytes)
+
+
+def sizes(
+    values: t.Sequence[int | float],
+    precision: int = DEFAULT_PRECISION,
+    out: list[str] | None = None,
+) -> list[str]:
+    """
+    Converts many sizes in bytes into human-friendly string representations.
+
+    Produces the same strings as :func:`size`, see :meth:`Formatter.many`.
+
+    Args:
+        values (Sequence[int | float]): The sizes in bytes to convert, e.g.
+            a list, an ``array.array`` or a ``memoryview`` of numbers.
+        precision (int, optional): The number of decimal places to round the
+            results to. Defaults to 2.
+        out (list[str], optional): A preallocated list to write the results to,
+            from its start. Defaults to a new list.
+
+    Returns:
+        list[str]: The results, ``out`` if it was provided.
+
+    Raises:
+        ValueError: If ``out`` is shorter than ``values``.
+
+    Examples:
+        >>> sizes([512, 1536, 3 * 1024**3], precision=1)
+        ['512.0 B', '1.5 KiB', '3.0 GiB']
+    """
+    return _size_formatter(precision).many(values, out)
+
+
+@functools.lru_cache
+def _size_formatter(precision: int) -> Formatter:
+    return Formatter(SIZE_UNIT, precision=precision)
+
+
+def parse_size(text: str) -> int:
+    """
+    Converts a human-friendly size into bytes, the inverse of :func:`size`.
+
+    Accepts decimal (SI) and binary (IEC) prefixes, with or without the byte
+    unit, case-insensitively: ``"200kB"``, ``"1.5G"`` and ``"512 MiB"`` are
+    200000, 1500000000 and 536870912 bytes. Parsing takes a match of a
+    precompiled regular expression and a dict lookup of the unit.
+
+    Args:
+        text (str): The size to convert, e.g. 1.50 KiB.
+
+    Returns:
+        int: The size in bytes, rounded to the nearest integer if it has
+            a fraction.
+
+    Raises:
+        ValueError: If the text is not a size with a known unit, or its
+            exponent has more than 3 digits.
+
+    Examples:
+        >>> parse_size(size(1536))
+        1536
+    """
+    match = _SIZE_PATTERN.fullmatch(text)
+    multiplier = _SIZE_MULTIPLIERS.get(match[2].lower()) if match else None
+    if match is None or multiplier is None:
+        raise ValueError(f"Invalid size: {text!r}")
+    number = match[1]
+    if number.lstrip("+-").isdigit():
+        return int(number) * multiplier
+    # exact, unlike floats, which round large sizes with decimal prefixes
+    return round(Fraction(number) * multiplier)
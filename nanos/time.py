@@ -1,27 +1,111 @@
 from __future__ import annotations
 
+import asyncio
+import bisect
+import contextlib
+import contextvars
 import datetime
+import functools
+import inspect
+import itertools
 import math
+import operator
+import threading
 import time
 import typing as t
+import warnings
+from array import array
+from collections.abc import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generator,
+    Iterator,
+    Mapping,
+)
 
 DEFAULT_TIMER_PRECISION: t.Final = 2
+DEFAULT_HISTOGRAM_BITS: t.Final = 7
+_NO_MIN: t.Final = 1 << 64
+_MIN_CANCEL_DELAY: t.Final = 0.001
+NS_PER_SECOND: t.Final = 1_000_000_000
+
+Clock = t.Callable[[], int]
+F = t.TypeVar("F", bound=Callable[..., t.Any])
+ClockName = t.Literal["perf_counter", "monotonic", "process_time", "thread_time", "time"]
+
+CLOCKS: t.Final[dict[str, Clock]] = {
+    "perf_counter": time.perf_counter_ns,
+    "monotonic": time.monotonic_ns,
+    "process_time": time.process_time_ns,
+    "thread_time": time.thread_time_ns,
+    "time": time.time_ns,
+}
+
+
+def get_clock(clock: ClockName | Clock) -> Clock:
+    """
+    Returns a clock function by its name.
+
+    Args:
+        clock (ClockName | Clock): Name of a clock from :const:`CLOCKS`, or a
+            function returning time in integer nanoseconds, which is returned
+            as is.
+
+    Returns:
+        Clock: Function returning time in integer nanoseconds.
+
+    Raises:
+        ValueError: If there is no clock with the given name.
+    """
+    if callable(clock):
+        return clock
+    try:
+        return CLOCKS[clock]
+    except KeyError:
+        raise ValueError(f"Unknown clock {clock!r}, expected one of {list(CLOCKS)}") from None
 
 
 class Timer:
     """
-    Initializes a Timer instance with optional precision.
+    Initializes a Timer instance with optional precision and clock.
+
+    Times are stored as integer nanoseconds, as returned by the clock, so
+    entering and exiting the timer costs a single clock call each.
 
     Args:
         precision (int): The number of decimal places to use
             for displaying fractional seconds. Defaults to 2.
+        clock (ClockName | Clock): The clock to measure time with, either a
+            name from :const:`CLOCKS` or a function returning integer
+            nanoseconds. Defaults to ``"perf_counter"``, a monotonic clock with
+            the highest available resolution. Use ``"process_time"`` or
+            ``"thread_time"`` to measure CPU time.
+        name (str | None): Name of the measured operation. Defaults to None.
+        histogram (Histogram | None): Histogram to record elapsed time of
+            every run to, so the timer can be reused. Defaults to None.
+        trace (bool | None): Whether to record runs as spans of a span tree.
+            If None, runs are recorded only inside a traced timer, as its
+            child spans, in the same thread or asyncio task. If False, runs
+            are never recorded. Defaults to None.
 
     Attributes:
         precision (int): Number of decimal places for time display.
-        start (float | None): The start time in seconds since epoch, or None
+        clock (Clock): The clock function.
+        name (str | None): Name of the measured operation.
+        histogram (Histogram | None): Histogram the runs are recorded to.
+        span (Span | None): Span of the last traced run, with spans of nested
+            timers as its children.
+        start_ns (int | None): The start time in clock nanoseconds, or None
             if not started.
-        end (float | None): The end time in seconds since epoch, or None if
+        end_ns (int | None): The end time in clock nanoseconds, or None if
             still running.
+        paused_ns (int): Time in nanoseconds the timer spent paused, not
+            counted as elapsed.
+
+    Raises:
+        ValueError: If there is no clock with the given name.
 
     Examples:
         Basic synchronous usage with context manager::
@@ -52,12 +136,12 @@ class Timer:
         Manual control without context manager::
 
             timer = Timer()
-            timer.start = time.time()
+            timer.start_ns = timer.clock()
 
             # Do some work
             time.sleep(0.5)
 
-            timer.end = time.time()
+            timer.end_ns = timer.clock()
             print(f"Work took: {timer.elapsed}s")
 
         Custom precision for high-resolution timing::
@@ -67,6 +151,46 @@ class Timer:
             print(timer.verbose())
             # Output: 0:00:00.0123
 
+        Aggregating many runs of a reusable timer::
+
+            timer = Timer(name="query", histogram=Histogram())
+            for query in queries:
+                with timer:
+                    run(query)
+            print(timer.histogram.summary())
+            # Output: {'count': 1000, 'mean': 15310.5, 'min': 9012, ...}
+
+        Breaking down a request by phases::
+
+            with Timer(name="request", trace=True) as timer:
+                with Timer(name="db"):
+                    load()
+                with Timer(name="render"):
+                    render()
+            print(timer.span.render())
+            # Output:
+            # request: 0:00:01.20 (self 0:00:00.01)
+            #   db: 0:00:01.00 (self 0:00:01.00)
+            #   render: 0:00:00.19 (self 0:00:00.19)
+
+        Splitting a loop into laps and leaving out waiting::
+
+            with Timer() as timer:
+                for item in items:
+                    process(item)
+                    timer.pause()
+                    lock.acquire()
+                    timer.resume()
+                    timer.lap()
+            print(timer.lap_stats())
+            # Output: {'count': 1000000, 'total': 15310..., 'mean': 1531.0, ...}
+
+        Measuring CPU time of the current thread in nanoseconds::
+
+            with Timer(clock="thread_time") as timer:
+                cpu_bound_operation()
+            print(f"CPU time: {timer.elapsed_ns}ns")
+
         Checking elapsed time while timer is still running::
 
             with Timer() as timer:
@@ -79,46 +203,96 @@ class Timer:
         Using timer in async loops::
 
             total_timer = Timer()
-            total_timer.start = time.time()
+            total_timer.start_ns = total_timer.clock()
 
             for item in items:
                 async with Timer() as request_timer:
                     await process_item(item)
                 print(f"Item processed in {request_timer.elapsed}s")
 
-            total_timer.end = time.time()
+            total_timer.end_ns = total_timer.clock()
             print(f"All items processed in {total_timer.verbose()}")
 
     Note:
-        The timer uses ``time.time()`` which measures wall-clock time, not CPU time.
-        For CPU time measurement, consider using ``time.process_time()`` or similar.
+        Only ``"time"`` clock measures wall-clock time since epoch, values of
+        other clocks have an undefined reference point, so only differences
+        between them make sense. ``start`` and ``end`` are float seconds views
+        of ``start_ns`` and ``end_ns``. Setting them is deprecated: it used to
+        take seconds of ``time.time()``, so a timer with the default clock
+        switches to the ``"time"`` clock when they are set, to keep elapsed
+        time right.
     """
 
-    def __init__(self, precision: int = DEFAULT_TIMER_PRECISION) -> None:
+    __slots__ = (
+        "precision",
+        "clock",
+        "name",
+        "histogram",
+        "trace",
+        "span",
+        "start_ns",
+        "end_ns",
+        "paused_ns",
+        "_span_token",
+        "_paused_at",
+        "_laps",
+        "_lapped_ns",
+    )
+
+    def __init__(
+        self,
+        precision: int = DEFAULT_TIMER_PRECISION,
+        clock: ClockName | Clock = "perf_counter",
+        *,
+        name: str | None = None,
+        histogram: Histogram | None = None,
+        trace: bool | None = None,
+    ) -> None:
         self.precision = precision
-        self.start: float | None = None
-        self.end: float | None = None
+        self.clock = CLOCKS["perf_counter"] if clock == "perf_counter" else get_clock(clock)
+        self.name = name
+        self.histogram = histogram
+        self.trace = trace
+        self.span: Span | None = None
+        self.start_ns: int | None = None
+        self.end_ns: int | None = None
+        self.paused_ns = 0
+        self._span_token: contextvars.Token[Span | None] | None = None
+        self._paused_at: int | None = None
+        self._laps: array[int] | None = None  # created by the first lap
+        self._lapped_ns = 0  # elapsed time at the end of the last lap
 
     def __enter__(self) -> Timer:
-        self.start = time.time()
+        if self.start_ns is not None:
+            self._reset()
+        self.start_ns = self.clock()
+        # there are no spans to nest into until a traced timer is started
+        if self.trace or (_tracing and self.trace is None):
+            self._push_span(_active_span.get())
         return self
 
     def __exit__(self, *args: t.Any) -> None:
-        self.end = time.time()
+        self.end_ns = end_ns = self.clock()
+        if self._paused_at is not None:
+            self._resume(end_ns)
+        if self._span_token is not None:
+            self._pop_span()
+        if self.histogram is not None:
+            self.histogram.record(end_ns - t.cast(int, self.start_ns) - self.paused_ns)
 
     # Async context manager methods
     async def __aenter__(self) -> Timer:
-        self.start = time.time()
-        return self
+        return self.__enter__()
 
     async def __aexit__(self, *args: t.Any) -> None:
-        self.end = time.time()
+        self.__exit__(*args)
 
     def __str__(self) -> str:
         return self.verbose()
 
     def __repr__(self) -> str:
-        return f"<Timer [start={self.start}, end={self.end}]>"
+        name = f"name={self.name!r}, " if self.name is not None else ""
+        return f"<{type(self).__name__} [{name}start={self.start}, end={self.end}]>"
 
     def verbose(self) -> str:
         """
@@ -132,17 +306,38 @@ class Timer:
         Returns:
             str: The formatted elapsed time as a string.
         """
-        fraction_seconds, whole_seconds = math.modf(self.elapsed)
-        rounded_fraction = round(fraction_seconds, self.precision)
-        if rounded_fraction >= 1:
-            whole_seconds += 1
-            formatted_fraction = "0" * self.precision
-        elif fraction_seconds == 0:
-            formatted_fraction = "0" * self.precision
-        else:
-            fraction = int(rounded_fraction * 10**self.precision)
-            formatted_fraction = str(fraction).zfill(self.precision)
-        return f"{datetime.timedelta(seconds=whole_seconds)}.{formatted_fraction}"
+        return _format_elapsed(self.elapsed, self.precision)
+
+    @property
+    def start(self) -> float | None:
+        """The start time in seconds, or None if not started."""
+        return _ns_to_seconds(self.start_ns)
+
+    @start.setter
+    def start(self, value: float | None) -> None:
+        self._set_seconds("start")
+        self.start_ns = _seconds_to_ns(value)
+
+    @property
+    def end(self) -> float | None:
+        """The end time in seconds, or None if still running."""
+        return _ns_to_seconds(self.end_ns)
+
+    @end.setter
+    def end(self, value: float | None) -> None:
+        self._set_seconds("end")
+        self.end_ns = _seconds_to_ns(value)
+
+    def _set_seconds(self, name: str) -> None:
+        warnings.warn(
+            f"Setting Timer.{name} in seconds is deprecated, "
+            f"set Timer.{name}_ns to Timer.clock() instead",
+            DeprecationWarning,
+            stacklevel=3,
+        )
+        # seconds used to come from time.time(), which the default clock can't be mixed with
+        if self.clock is time.perf_counter_ns:
+            self.clock = time.time_ns
 
     @property
     def elapsed(self) -> float:
@@ -157,6 +352,934 @@ class Timer:
         Returns:
             float: The elapsed time in seconds.
         """
-        if not self.start:
-            return 0.0
-        return (self.end or time.time()) - self.start
+        return self.elapsed_ns / NS_PER_SECOND
+
+    @property
+    def elapsed_ns(self) -> int:
+        """
+        Calculates the elapsed time in integer nanoseconds.
+
+        Works the same way as :attr:`elapsed`, without losing precision.
+
+        Returns:
+            int: The elapsed time in nanoseconds.
+        """
+        if self.start_ns is None:
+            return 0
+        end_ns = self.clock() if self.end_ns is None else self.end_ns
+        paused_ns = (
+            self.paused_ns if self._paused_at is None else self.paused_ns + end_ns - self._paused_at
+        )
+        return end_ns - self.start_ns - paused_ns
+
+    @property
+    def laps(self) -> array[int]:
+        """Durations of laps of the last run in nanoseconds."""
+        if self._laps is None:
+            self._laps = array("q")
+        return self._laps
+
+    @property
+    def paused(self) -> bool:
+        """Whether the timer is paused."""
+        return self._paused_at is not None
+
+    def pause(self) -> None:
+        """
+        Pauses the timer, time until :meth:`resume` is not counted as elapsed.
+
+        Raises:
+            RuntimeError: If the timer is not running or already paused.
+        """
+        paused_at = self.clock()
+        self._check_running()
+        if self._paused_at is not None:
+            raise RuntimeError("Timer is already paused")
+        self._paused_at = paused_at
+
+    def resume(self) -> None:
+        """
+        Resumes the paused timer.
+
+        Raises:
+            RuntimeError: If the timer is not running or not paused.
+        """
+        resumed_at = self.clock()
+        self._check_running()
+        if self._paused_at is None:
+            raise RuntimeError("Timer is not paused")
+        self._resume(resumed_at)
+
+    def lap(self) -> int:
+        """
+        Ends the current lap and starts the next one.
+
+        A lap lasts from the start of the timer or the end of the previous lap,
+        time the timer was paused for is not counted. Lap durations are stored
+        in :attr:`laps`, which are cleared when the timer is started again.
+
+        Returns:
+            int: Duration of the lap in nanoseconds.
+
+        Raises:
+            RuntimeError: If the timer is not running.
+        """
+        elapsed_ns = self.elapsed_ns
+        self._check_running()
+        lap_ns = elapsed_ns - self._lapped_ns
+        self.laps.append(lap_ns)
+        self._lapped_ns = elapsed_ns
+        return lap_ns
+
+    def lap_stats(self) -> dict[str, float]:
+        """
+        Returns count, total, mean, stdev, min, max and p50, p90, p99 of laps.
+
+        Percentiles are nearest-rank values of the laps, all values except
+        count are in nanoseconds.
+
+        Returns:
+            dict[str, float]: Statistics by name, zeros if there are no laps.
+        """
+        laps = sorted(self.laps)
+        count, total = len(laps), sum(laps)
+        if not count:
+            return dict.fromkeys(
+                ("count", "total", "mean", "stdev", "min", "max", "p50", "p90", "p99"), 0
+            )
+        mean = total / count
+        p50, p90, p99 = (
+            laps[max(1, math.ceil(percent * count / 100)) - 1] for percent in (50, 90, 99)
+        )
+        return {
+            "count": count,
+            "total": total,
+            "mean": mean,
+            "stdev": math.sqrt(
+                (count * sum(map(operator.mul, laps, laps)) - total * total) / count**2
+            ),
+            "min": laps[0],
+            "max": laps[-1],
+            "p50": p50,
+            "p90": p90,
+            "p99": p99,
+        }
+
+    def _check_running(self) -> None:
+        if self.start_ns is None or self.end_ns is not None:
+            raise RuntimeError("Timer is not running")
+
+    def _reset(self) -> None:
+        self.end_ns = None
+        self.paused_ns = self._lapped_ns = 0
+        self._paused_at = None
+        self._laps = None
+
+    def _resume(self, resumed_at: int) -> None:
+        self.paused_ns += resumed_at - t.cast(int, self._paused_at)
+        self._paused_at = None
+
+    def _push_span(self, parent: Span | None) -> None:
+        global _tracing
+        if parent is None:
+            if not self.trace:
+                return
+            _tracing = True
+        self.span = Span(self.name or "timer", t.cast(int, self.start_ns), self.clock)
+        if parent is not None:
+            parent.children.append(self.span)
+        self._span_token = _active_span.set(self.span)
+
+    def _pop_span(self) -> None:
+        _active_span.reset(t.cast(contextvars.Token[Span | None], self._span_token))
+        self._span_token = None
+        t.cast(Span, self.span).end_ns = self.end_ns
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a :class:`Deadline` runs out of its budget."""
+
+
+class Deadline(Timer):
+    """
+    Timer with a time budget, to stop work that doesn't fit into it.
+
+    The budget is checked against :attr:`Timer.elapsed_ns`, so time the
+    deadline is paused for doesn't count. When the block ends over the budget,
+    ``on_expire`` is called with the deadline, then :exc:`DeadlineExceeded`
+    is raised if ``raise_on_expire`` is set, unless the block raised another
+    exception, which is left to propagate.
+
+    As an async context manager, the deadline also cancels the task running
+    the block when the budget runs out, like :func:`asyncio.timeout` does,
+    and raises :exc:`DeadlineExceeded` instead of the cancellation. Other
+    cancellations of the task are never converted.
+
+    Args:
+        budget (float): The time budget in seconds.
+        precision (int): The number of decimal places to use
+            for displaying fractional seconds. Defaults to 2.
+        clock (ClockName | Clock): The clock to measure time with. Defaults to
+            ``"perf_counter"``.
+        on_expire (Callable[[Deadline], t.Any] | None): Function to call
+            when the block ends over the budget. Defaults to None.
+        raise_on_expire (bool): Whether to raise :exc:`DeadlineExceeded` when
+            the block ends over the budget. Defaults to False.
+        cancel (bool): Whether to cancel the async block when the budget runs
+            out. Defaults to True.
+        **kwargs: Other keyword arguments of :class:`Timer`.
+
+    Raises:
+        ValueError: If the budget is negative.
+
+    Examples:
+        Doing as much work as fits in 200ms::
+
+            with Deadline(0.2) as deadline:
+                while not deadline.expired and queue:
+                    process(queue.pop())
+
+        Cancelling a slow call::
+
+            try:
+                async with Deadline(0.2):
+                    await fetch(url)
+            except DeadlineExceeded:
+                return cached(url)
+
+        Logging overruns::
+
+            with Deadline(0.2, on_expire=lambda d: logger.warning("Slow: %s", d)):
+                handle(request)
+    """
+
+    __slots__ = (
+        "budget_ns",
+        "on_expire",
+        "raise_on_expire",
+        "cancel",
+        "_cancel_handle",
+        "_cancelled_task",
+        "_cancelling",
+    )
+
+    def __init__(
+        self,
+        budget: float,
+        precision: int = DEFAULT_TIMER_PRECISION,
+        clock: ClockName | Clock = "perf_counter",
+        *,
+        on_expire: Callable[[Deadline], t.Any] | None = None,
+        raise_on_expire: bool = False,
+        cancel: bool = True,
+        **kwargs: t.Any,
+    ) -> None:
+        if budget < 0:
+            raise ValueError(f"Budget must be non-negative, got {budget}")
+        super().__init__(precision, clock, **kwargs)
+        self.budget_ns = round(budget * NS_PER_SECOND)
+        self.on_expire = on_expire
+        self.raise_on_expire = raise_on_expire
+        self.cancel = cancel
+        self._cancel_handle: asyncio.TimerHandle | None = None
+        self._cancelled_task: asyncio.Task[t.Any] | None = None
+        self._cancelling = 0  # cancellation requests of the task made before the block
+
+    def __exit__(self, exc_type: type[BaseException] | None, *args: t.Any) -> None:
+        super().__exit__(exc_type, *args)
+        if self.expired:
+            self._expire(raise_on_expire=self.raise_on_expire and exc_type is None)
+
+    async def __aenter__(self) -> Deadline:
+        self.__enter__()
+        self._cancelled_task = None
+        task = asyncio.current_task()
+        cancelling = getattr(task, "cancelling", None)  # Python 3.11+
+        self._cancelling = cancelling() if cancelling is not None else 0
+        if self.cancel:
+            self._schedule_cancel(task)
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, *args: t.Any) -> None:
+        if self._cancel_handle is not None:
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+        if self._uncancel() and exc_type is asyncio.CancelledError:
+            Timer.__exit__(self, exc_type, *args)
+            self._expire(raise_on_expire=True)
+        self.__exit__(exc_type, *args)
+
+    @property
+    def budget(self) -> float:
+        """The time budget in seconds."""
+        return self.budget_ns / NS_PER_SECOND
+
+    @property
+    def expired(self) -> bool:
+        """Whether the elapsed time reached the budget."""
+        return self.elapsed_ns >= self.budget_ns
+
+    def remaining_ns(self) -> int:
+        """
+        Returns the time left until the budget runs out.
+
+        Returns:
+            int: The remaining time in nanoseconds, 0 if expired.
+        """
+        return max(0, self.budget_ns - self.elapsed_ns)
+
+    def remaining(self) -> float:
+        """
+        Returns the time left until the budget runs out.
+
+        Returns:
+            float: The remaining time in seconds, 0.0 if expired.
+        """
+        return self.remaining_ns() / NS_PER_SECOND
+
+    def check(self) -> None:
+        """
+        Raises :exc:`DeadlineExceeded` if the budget ran out.
+
+        Raises:
+            DeadlineExceeded: If the deadline is expired.
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline of {self.budget}s exceeded")
+
+    def _expire(self, raise_on_expire: bool) -> None:
+        if self.on_expire is not None:
+            self.on_expire(self)
+        if raise_on_expire:
+            raise DeadlineExceeded(f"Deadline of {self.budget}s exceeded")
+
+    def _schedule_cancel(self, task: asyncio.Task[t.Any] | None) -> None:
+        if task is None:
+            return
+        if self.expired and not self.paused:
+            self._cancel_handle = None
+            self._cancelled_task = task
+            task.cancel()
+            return
+        # the budget may be extended by pauses, so it's checked again when it should run out
+        delay = max(self.remaining(), _MIN_CANCEL_DELAY)
+        self._cancel_handle = asyncio.get_running_loop().call_later(
+            delay, self._schedule_cancel, task
+        )
+
+    def _uncancel(self) -> bool:
+        """Withdraws cancellation made by the deadline, tells if there are no other new ones.
+
+        Cancellations requested before the block started don't count, as
+        :func:`asyncio.timeout` does.
+        """
+        task, self._cancelled_task = self._cancelled_task, None
+        if task is None:
+            return False
+        uncancel = getattr(task, "uncancel", None)  # Python 3.11+
+        return uncancel is None or uncancel() <= self._cancelling
+
+
+class Span:
+    """
+    A node of a span tree, a single run of a traced :class:`Timer`.
+
+    Children are runs of timers started while the span was active in the same
+    thread or asyncio task, including tasks started by it. Children may
+    overlap if they run concurrently, in which case the self time is clamped
+    to 0.
+
+    Args:
+        name (str): Name of the timer.
+        start_ns (int): The start time in clock nanoseconds.
+        clock (Clock): The clock of the timer.
+
+    Attributes:
+        name (str): Name of the timer.
+        start_ns (int): The start time in clock nanoseconds.
+        end_ns (int | None): The end time in clock nanoseconds, or None if
+            still running.
+        children (list[Span]): Spans of nested timers, in start order.
+    """
+
+    __slots__ = ("name", "start_ns", "end_ns", "children", "clock")
+
+    def __init__(self, name: str, start_ns: int, clock: Clock) -> None:
+        self.name = name
+        self.start_ns = start_ns
+        self.end_ns: int | None = None
+        self.children: list[Span] = []
+        self.clock = clock
+
+    def __repr__(self) -> str:
+        return (
+            f"<Span [name={self.name!r}, total_ns={self.total_ns}, children={len(self.children)}]>"
+        )
+
+    @property
+    def total_ns(self) -> int:
+        """The elapsed time of the span in nanoseconds, up to now if still running."""
+        end_ns = self.clock() if self.end_ns is None else self.end_ns
+        return end_ns - self.start_ns
+
+    @property
+    def self_ns(self) -> int:
+        """The elapsed time of the span in nanoseconds, not spent in children."""
+        return max(0, self.total_ns - sum(child.total_ns for child in self.children))
+
+    def walk(self) -> Iterator[tuple[int, Span]]:
+        """
+        Iterates over the span and its descendants, depth-first.
+
+        Yields:
+            tuple[int, Span]: Depth of the span, 0 for this span, and the span.
+        """
+        stack = [(0, self)]
+        while stack:
+            depth, span = stack.pop()
+            yield depth, span
+            stack.extend((depth + 1, child) for child in reversed(span.children))
+
+    def render(self, precision: int = DEFAULT_TIMER_PRECISION, indent: str = "  ") -> str:
+        """
+        Renders the span tree, with total and self time of every span.
+
+        Times are formatted the same way as :meth:`Timer.verbose` does.
+
+        Args:
+            precision (int): The number of decimal places of fractional
+                seconds. Defaults to 2.
+            indent (str): Indentation of every level. Defaults to two spaces.
+
+        Returns:
+            str: The rendered tree, a line per span.
+        """
+        return "\n".join(
+            f"{indent * depth}{span.name}: "
+            f"{_format_elapsed(span.total_ns / NS_PER_SECOND, precision)} "
+            f"(self {_format_elapsed(span.self_ns / NS_PER_SECOND, precision)})"
+            for depth, span in self.walk()
+        )
+
+
+_active_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "nanos_active_span", default=None
+)
+# Whether a traced timer was ever started, so untraced timers can skip looking for spans
+_tracing = False
+
+
+def current_span() -> Span | None:
+    """
+    Returns the span of the innermost traced timer running in the current context.
+
+    Returns:
+        Span | None: The active span, or None if there is no traced timer running.
+    """
+    return _active_span.get()
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative integers, e.g. durations in nanoseconds.
+
+    Values are counted in buckets instead of being stored, so memory usage is
+    fixed whatever number of values is recorded. Values below
+    ``2 ** bits`` are counted exactly, bigger ones in buckets which width is
+    at most ``1 / 2 ** (bits - 1)`` of the value, so percentiles are accurate
+    within this relative error (~1.6% by default). Count, sum, min and max are
+    exact. Recording is thread-safe.
+
+    Args:
+        bits (int): Number of bits of value precision, between 1 and 16.
+            Defaults to 7, which takes ~30KiB for values up to ``2 ** 64``.
+
+    Raises:
+        ValueError: If ``bits`` is out of range.
+
+    Examples:
+        Recording values and getting percentiles::
+
+            histogram = Histogram()
+            for value in range(1, 1001):
+                histogram.record(value)
+            print(histogram.count, histogram.mean, histogram.p99)
+            # Output: 1000 500.5 988
+    """
+
+    def __init__(self, bits: int = DEFAULT_HISTOGRAM_BITS) -> None:
+        if not 1 <= bits <= 16:
+            raise ValueError(f"Histogram bits must be between 1 and 16, got {bits}")
+        self.bits = bits
+        self._half = 1 << (bits - 1)
+        self._counts = array("Q", bytes(8 * (66 - bits) * self._half))
+        self._last = len(self._counts) - 1
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self._min = _NO_MIN
+
+    def __repr__(self) -> str:
+        return f"<Histogram [count={self.count}, mean={self.mean}, max={self.max}]>"
+
+    def record(self, value: int, count: int = 1) -> None:
+        """
+        Records a value.
+
+        Args:
+            value (int): The value to record, must be non-negative, values
+                over ``2 ** 64 - 1`` are counted as ``2 ** 64 - 1``.
+            count (int): How many times to record the value. Defaults to 1.
+
+        Raises:
+            ValueError: If the value is negative.
+        """
+        if value < 0:
+            raise ValueError(f"Can't record negative value {value}")
+        shift = value.bit_length() - self.bits
+        index = value if shift <= 0 else min(shift * self._half + (value >> shift), self._last)
+        with self._lock:
+            self._counts[index] += count
+            self.count += count
+            self.total += value * count
+            if value < self._min:
+                self._min = value
+            if value > self.max:
+                self.max = value
+
+    @property
+    def min(self) -> int:
+        """The minimum of recorded values, 0 if there are none."""
+        return self._min if self.count else 0
+
+    @property
+    def mean(self) -> float:
+        """The mean of recorded values, 0.0 if there are none."""
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def p50(self) -> int:
+        """The median of recorded values."""
+        return self.percentile(50)
+
+    @property
+    def p90(self) -> int:
+        """The 90th percentile of recorded values."""
+        return self.percentile(90)
+
+    @property
+    def p99(self) -> int:
+        """The 99th percentile of recorded values."""
+        return self.percentile(99)
+
+    @property
+    def p999(self) -> int:
+        """The 99.9th percentile of recorded values."""
+        return self.percentile(99.9)
+
+    def percentile(self, percent: float) -> int:
+        """
+        Returns the value below or at which given percent of values fall.
+
+        The value is the middle of the bucket the percentile is in, but never
+        less than the minimum or more than the maximum recorded value.
+
+        Args:
+            percent (float): Percent between 0 and 100.
+
+        Returns:
+            int: The percentile value, 0 if no values were recorded.
+
+        Raises:
+            ValueError: If the percent is out of range.
+        """
+        return self.percentiles(percent)[0]
+
+    def percentiles(self, *percents: float) -> list[int]:
+        """
+        Returns values of several percentiles at once.
+
+        Args:
+            *percents (float): Percents between 0 and 100.
+
+        Returns:
+            list[int]: Percentile values in the same order.
+
+        Raises:
+            ValueError: If a percent is out of range.
+        """
+        if any(not 0 <= percent <= 100 for percent in percents):
+            raise ValueError(f"Percents must be between 0 and 100, got {percents}")
+        with self._lock:
+            cumulative = list(itertools.accumulate(self._counts))
+            count, low, high = self.count, self._min, self.max
+        if not count:
+            return [0] * len(percents)
+        ranks = (max(1, math.ceil(percent * count / 100)) for percent in percents)
+        values = (self._value(bisect.bisect_left(cumulative, rank)) for rank in ranks)
+        return [min(max(value, low), high) for value in values]
+
+    def summary(self) -> dict[str, float]:
+        """
+        Returns count, mean, min, max and p50, p90, p99, p999 of recorded values.
+
+        Returns:
+            dict[str, float]: Statistics by name.
+        """
+        p50, p90, p99, p999 = self.percentiles(50, 90, 99, 99.9)
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min,
+            "max": self.max,
+            "p50": p50,
+            "p90": p90,
+            "p99": p99,
+            "p999": p999,
+        }
+
+    def merge(self, other: Histogram) -> None:
+        """
+        Adds values recorded by another histogram to this one.
+
+        Args:
+            other (Histogram): Histogram with the same number of bits.
+
+        Raises:
+            ValueError: If histograms have different number of bits.
+        """
+        if other.bits != self.bits:
+            raise ValueError(f"Can't merge histograms of {other.bits} and {self.bits} bits")
+        with other._lock:
+            counts = array("Q", other._counts)
+            count, total, low, high = other.count, other.total, other._min, other.max
+        with self._lock:
+            self._counts = array("Q", map(sum, zip(self._counts, counts, strict=True)))
+            self._min = min(low, self._min)
+            self.max = max(high, self.max)
+            self.count += count
+            self.total += total
+
+    def reset(self) -> None:
+        """Removes all recorded values."""
+        with self._lock:
+            self._counts = array("Q", bytes(len(self._counts) * 8))
+            self.count = self.total = self.max = 0
+            self._min = _NO_MIN
+
+    def _value(self, index: int) -> int:
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        return ((index - shift * self._half) << shift) + (1 << shift) // 2
+
+
+class TimerRegistry(Mapping[str, Histogram]):
+    """
+    Registry of named histograms, with timers recording to them.
+
+    Works as a read-only mapping of names to histograms, which are created on
+    first use, so every operation can be tracked by name in long-running
+    processes with constant memory.
+
+    Args:
+        precision (int): Precision of created timers. Defaults to 2.
+        clock (ClockName | Clock): Clock of created timers. Defaults to
+            ``"perf_counter"``.
+        bits (int): Number of bits of value precision of created histograms.
+            Defaults to 7.
+        enabled (bool): Whether functions decorated with :func:`timed` are
+            measured. Defaults to True.
+
+    Attributes:
+        enabled (bool): Whether functions decorated with :func:`timed` are
+            measured, can be switched at any time.
+
+    Examples:
+        Tracking latency per endpoint::
+
+            registry = TimerRegistry()
+
+            async def handle(request):
+                async with registry.timer(request.path):
+                    return await dispatch(request)
+
+            for path, histogram in registry.items():
+                print(path, histogram.p50, histogram.p99)
+    """
+
+    def __init__(
+        self,
+        precision: int = DEFAULT_TIMER_PRECISION,
+        clock: ClockName | Clock = "perf_counter",
+        bits: int = DEFAULT_HISTOGRAM_BITS,
+        enabled: bool = True,
+    ) -> None:
+        self.precision = precision
+        self.clock = get_clock(clock)
+        self.bits = bits
+        self.enabled = enabled
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Histogram:
+        return self._histograms[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._histograms))
+
+    def __len__(self) -> int:
+        return len(self._histograms)
+
+    def __repr__(self) -> str:
+        return f"<TimerRegistry [names={len(self)}]>"
+
+    def histogram(self, name: str) -> Histogram:
+        """
+        Returns a histogram by name, creating it if needed.
+
+        Args:
+            name (str): Name of the histogram.
+
+        Returns:
+            Histogram: The histogram.
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, Histogram(self.bits))
+        return histogram
+
+    def timer(self, name: str) -> Timer:
+        """
+        Returns a new timer recording to the histogram with the given name.
+
+        A timer can be reused, but not shared by concurrent runs, so a new
+        timer should be taken for every thread or task.
+
+        Args:
+            name (str): Name of the histogram.
+
+        Returns:
+            Timer: The timer.
+        """
+        return Timer(self.precision, self.clock, name=name, histogram=self.histogram(name))
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Returns summaries of all histograms by name.
+
+        Returns:
+            dict[str, dict[str, float]]: See :meth:`Histogram.summary`.
+        """
+        return {name: histogram.summary() for name, histogram in self.items()}
+
+    def reset(self) -> None:
+        """Removes all histograms."""
+        with self._lock:
+            self._histograms = {}
+
+
+default_registry: t.Final = TimerRegistry()
+
+
+@t.overload
+def timed(func: F, /) -> F: ...
+
+
+@t.overload
+def timed(
+    *, name: str | None = None, registry: TimerRegistry | None = None
+) -> Callable[[F], F]: ...
+
+
+def timed(
+    func: F | None = None,
+    /,
+    *,
+    name: str | None = None,
+    registry: TimerRegistry | None = None,
+) -> F | Callable[[F], F]:
+    """
+    Decorator that times every call of a function into a registry histogram.
+
+    Works with regular functions, coroutine functions, generator and async
+    generator functions. Coroutines are measured until they return,
+    generators from the first iteration until they are exhausted or closed,
+    so the time consumer spends between items is included. Values sent into
+    async generators are not passed through to them. Every call is
+    measured with a new :class:`Timer` from :meth:`TimerRegistry.timer`.
+
+    When the registry is disabled, the function is called directly, so the
+    cost is a single attribute check per call.
+
+    Args:
+        func (F | None): The function to decorate, when used without
+            arguments.
+        name (str | None): Name of the histogram. Defaults to the module and
+            qualified name of the function.
+        registry (TimerRegistry | None): Registry to record to. Defaults to
+            :data:`default_registry`.
+
+    Returns:
+        F | Callable[[F], F]: The decorated function, or a decorator when
+        called with keyword arguments only.
+
+    Examples:
+        Timing service methods::
+
+            class UserService:
+                @timed
+                def get(self, user_id): ...
+
+                @timed(name="users.save")
+                async def save(self, user): ...
+
+            print(default_registry.summary())
+            # Output: {'app.UserService.get': {'count': 12, ...}, 'users.save': {...}}
+
+        Turning instrumentation off::
+
+            default_registry.enabled = False
+    """
+
+    def decorate(func: F) -> F:
+        wrap = _get_wrapper(func)
+        wrapper = wrap(
+            func,
+            name or f"{func.__module__}.{func.__qualname__}",
+            default_registry if registry is None else registry,
+        )
+        return t.cast(F, functools.wraps(func)(wrapper))
+
+    return decorate if func is None else decorate(func)
+
+
+def _get_wrapper(func: Callable[..., t.Any]) -> Callable[..., Callable[..., t.Any]]:
+    if inspect.iscoroutinefunction(func):
+        return _wrap_coroutine_function
+    if inspect.isasyncgenfunction(func):
+        return _wrap_async_generator_function
+    if inspect.isgeneratorfunction(func):
+        return _wrap_generator_function
+    return _wrap_function
+
+
+def _wrap_function(
+    func: Callable[..., t.Any], name: str, registry: TimerRegistry
+) -> Callable[..., t.Any]:
+    def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        if not registry.enabled:
+            return func(*args, **kwargs)
+        with registry.timer(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _wrap_coroutine_function(
+    func: Callable[..., Awaitable[t.Any]], name: str, registry: TimerRegistry
+) -> Callable[..., Awaitable[t.Any]]:
+    async def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        if not registry.enabled:
+            return await func(*args, **kwargs)
+        async with registry.timer(name):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def _wrap_generator_function(
+    func: Callable[..., Generator[t.Any, t.Any, t.Any]], name: str, registry: TimerRegistry
+) -> Callable[..., Generator[t.Any, t.Any, t.Any]]:
+    def wrapper(*args: t.Any, **kwargs: t.Any) -> Generator[t.Any, t.Any, t.Any]:
+        if not registry.enabled:
+            return (yield from func(*args, **kwargs))
+        parent = _active_span.get()
+        with registry.timer(name):
+            span = _active_span.get()
+            if span is parent:
+                return (yield from func(*args, **kwargs))
+            return (yield from _suspend_span(func(*args, **kwargs), span, parent))
+
+    return wrapper
+
+
+def _suspend_span(
+    generator: Generator[t.Any, t.Any, t.Any], span: Span | None, parent: Span | None
+) -> Generator[t.Any, t.Any, t.Any]:
+    """Delegates to the generator as ``yield from`` does, with the parent span
+    active while it's suspended, so the consumer's timers don't become its children.
+    """
+    value, resume = None, generator.send
+    while True:
+        _active_span.set(span)
+        try:
+            item = resume(value)
+        except StopIteration as stop:
+            return stop.value
+        span = _active_span.get()  # the generator may be suspended in a nested timer
+        _active_span.set(parent)
+        try:
+            value, resume = (yield item), generator.send
+        except GeneratorExit:
+            generator.close()
+            raise
+        except BaseException as err:
+            value, resume = err, generator.throw
+
+
+def _wrap_async_generator_function(
+    func: Callable[..., AsyncGenerator[t.Any, t.Any]], name: str, registry: TimerRegistry
+) -> Callable[..., AsyncIterator[t.Any]]:
+    # unlike yield from, async for doesn't close the inner generator when the wrapper is closed
+    async def wrapper(*args: t.Any, **kwargs: t.Any) -> AsyncIterator[t.Any]:
+        if not registry.enabled:
+            async with contextlib.aclosing(func(*args, **kwargs)) as generator:
+                async for item in generator:
+                    yield item
+            return
+        parent = _active_span.get()
+        async with registry.timer(name), contextlib.aclosing(func(*args, **kwargs)) as generator:
+            async for item in _asuspend_span(generator, _active_span.get(), parent):
+                yield item
+
+    return wrapper
+
+
+async def _asuspend_span(
+    iterator: AsyncIterator[t.Any], span: Span | None, parent: Span | None
+) -> AsyncIterator[t.Any]:
+    """Iterates over the async generator with the parent span active while it's suspended."""
+    while True:
+        _active_span.set(span)
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
+        span = _active_span.get()
+        _active_span.set(parent)
+        yield item
+
+
+def _format_elapsed(seconds: float, precision: int) -> str:
+    fraction_seconds, whole_seconds = math.modf(seconds)
+    rounded_fraction = round(fraction_seconds, precision)
+    if rounded_fraction >= 1:
+        whole_seconds += 1
+        formatted_fraction = "0" * precision
+    elif fraction_seconds == 0:
+        formatted_fraction = "0" * precision
+    else:
+        fraction = int(rounded_fraction * 10**precision)
+        formatted_fraction = str(fraction).zfill(precision)
+    return f"{datetime.timedelta(seconds=whole_seconds)}.{formatted_fraction}"
+
+
+def _ns_to_seconds(value: int | None) -> float | None:
+    return None if value is None else value / NS_PER_SECOND
+
+
+def _seconds_to_ns(value: float | None) -> int | None:
+    return None if value is None else round(value * NS_PER_SECOND)
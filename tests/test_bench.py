@@ -0,0 +1,168 @@
+import json
+import math
+from functools import partial
+
+import pytest
+from hamcrest import assert_that, close_to, equal_to
+
+from nanos import bench
+
+
+class FakeClock:
+    """Clock that is advanced only by the benchmarked function."""
+
+    def __init__(self) -> None:
+        self.now = 0
+
+    def __call__(self) -> int:
+        return self.now
+
+    def advance(self, ns: int) -> None:
+        self.now += ns
+
+
+def make_result(*timings: float, name: str = "func") -> bench.BenchmarkResult:
+    return bench.BenchmarkResult(name, 100, timings)
+
+
+class TestBenchmark:
+    def test__calibration(self) -> None:
+        clock = FakeClock()
+
+        result = bench.benchmark(
+            partial(clock.advance, 1000), name="advance", rounds=5, round_time=0.001, clock=clock
+        )
+
+        assert_that(result.name, equal_to("advance"))
+        assert_that(result.iterations, equal_to(1000))
+        assert_that(result.timings, equal_to((1e-6,) * 5))
+
+    def test__warmup(self) -> None:
+        calls = []
+
+        result = bench.benchmark(partial(calls.append, 1), rounds=3, warmup=2, iterations=10)
+
+        assert_that(len(calls), equal_to(50))
+        assert_that(result.name, equal_to("list.append"))
+        assert_that(result.rounds, equal_to(3))
+
+    def test__real_clock(self) -> None:
+        result = bench.benchmark(partial(sum, range(100)), rounds=3, round_time=0.001)
+
+        assert_that(result.iterations > 1, equal_to(True))
+        assert_that(result.min > 0, equal_to(True))
+
+    @pytest.mark.parametrize("kwargs", [{"rounds": 1}, {"iterations": 0}])
+    def test__invalid(self, kwargs) -> None:
+        with pytest.raises(ValueError):
+            bench.benchmark(lambda: None, **kwargs)
+
+
+class TestBenchmarkResult:
+    def test__summary(self) -> None:
+        result = make_result(1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 100.0)
+
+        assert_that(
+            result.summary(),
+            equal_to(
+                {
+                    "rounds": 9,
+                    "iterations": 100,
+                    "mean": 136 / 9,
+                    "stdev": result.stdev,
+                    "median": 5.0,
+                    "min": 1.0,
+                    "max": 100.0,
+                    "q1": 3.0,
+                    "q3": 7.0,
+                    "iqr": 4.0,
+                    "outliers": 1,
+                }
+            ),
+        )
+        assert_that(result.stdev, close_to(31.92, 0.01))
+        assert_that(result.outliers, equal_to((100.0,)))
+
+    def test__single_round(self) -> None:
+        result = make_result(0.5)
+
+        assert_that((result.q1, result.q3, result.stdev), equal_to((0.5, 0.5, 0.0)))
+
+    def test__str(self) -> None:
+        result = make_result(1e-6, 2e-6, 3e-6, 4e-6, 5e-6)
+
+        assert_that(str(result), equal_to("func: 3.00 us (IQR 2.00 us, 5x100)"))
+
+
+class TestCompare:
+    @pytest.mark.parametrize(
+        "candidate, verdict",
+        [
+            ((1.0, 1.1, 1.2, 1.3), "same"),
+            ((1.5, 1.6, 1.7, 1.8), "slower"),
+            ((0.5, 0.6, 0.7, 0.8), "faster"),
+            ((0.1, 0.6, 0.7, 10.0), "same"),
+            ((1.16, 1.17, 1.18, 1.19), "same"),
+        ],
+    )
+    def test__verdict(self, candidate, verdict) -> None:
+        comparison = bench.compare(make_result(1.0, 1.1, 1.2, 1.3), make_result(*candidate))
+
+        assert_that(comparison.verdict, equal_to(verdict))
+        assert_that(comparison.regression, equal_to(verdict == "slower"))
+
+    @pytest.mark.parametrize(
+        "candidate, ratio, verdict", [((0.0, 0.0), 1.0, "same"), ((1.0, 1.0), math.inf, "slower")]
+    )
+    def test__zero_baseline(self, candidate, ratio, verdict) -> None:
+        comparison = bench.compare(make_result(0.0, 0.0), make_result(*candidate))
+
+        assert_that(comparison.ratio, equal_to(ratio))
+        assert_that(comparison.verdict, equal_to(verdict))
+
+    def test__compare_files__zero_baseline(self, tmp_path) -> None:
+        baseline, candidate = tmp_path / "baseline.json", tmp_path / "candidate.json"
+        bench.save([make_result(0.0, 0.0, name="a")], baseline)
+        bench.save([make_result(1.0, 1.0, name="a")], candidate)
+
+        comparison = bench.compare_files(baseline, candidate)["a"]
+
+        assert_that(str(comparison), equal_to("a: 0.00 ns -> 1.00 s (xinf, slower)"))
+
+    def test__str(self) -> None:
+        comparison = bench.compare(make_result(1e-3, 1e-3), make_result(2e-3, 2e-3))
+
+        assert_that(str(comparison), equal_to("func: 1.00 ms -> 2.00 ms (x2.00, slower)"))
+
+    def test__compare_funcs(self) -> None:
+        clock = FakeClock()
+
+        comparison = bench.compare_funcs(
+            partial(clock.advance, 1000),
+            partial(clock.advance, 3000),
+            rounds=3,
+            round_time=0.001,
+            clock=clock,
+        )
+
+        assert_that(comparison.candidate.iterations, equal_to(1000))
+        assert_that(comparison.ratio, equal_to(3.0))
+        assert_that(comparison.verdict, equal_to("slower"))
+
+    def test__save_load(self, tmp_path) -> None:
+        baseline, candidate = tmp_path / "baseline.json", tmp_path / "candidate.json"
+        bench.save([make_result(1.0, 1.1, name="a"), make_result(1.0, name="b")], baseline)
+        bench.save([make_result(2.0, 2.1, name="a"), make_result(1.0, name="c")], candidate)
+
+        assert_that(bench.load(baseline)["a"], equal_to(make_result(1.0, 1.1, name="a")))
+        comparisons = bench.compare_files(baseline, candidate)
+        assert_that(list(comparisons), equal_to(["a"]))
+        assert_that(comparisons["a"].regression, equal_to(True))
+
+    @pytest.mark.parametrize("content", [{}, {"results": [{"name": "a", "timings": []}]}, []])
+    def test__load__invalid(self, tmp_path, content) -> None:
+        path = tmp_path / "results.json"
+        path.write_text(json.dumps(content))
+
+        with pytest.raises(ValueError):
+            bench.load(path)
@@ -1,3 +1,10 @@
+import array
+import asyncio
+import io
+import json
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from unittest import mock
 
 import pytest
@@ -8,6 +15,8 @@ import nanos
 DUMMY_OBJ = mock.Mock()
 DUMMY_OBJ.id = 42
 
+Point = namedtuple("Point", ["x", "y"])
+
 
 def dummy_generator():
     for number in range(1, 3):
@@ -23,12 +32,63 @@ def dummy_generator():
         ([{"id": "a"}, {"id": "b"}], {"a": {"id": "a"}, "b": {"id": "b"}}),
         (DUMMY_OBJ, {42: DUMMY_OBJ}),
         (dummy_generator(), {1: {"id": 1, "field": "1"}, 2: {"id": 2, "field": "2"}}),
+        (iter([{"id": "a"}, DUMMY_OBJ]), {"a": {"id": "a"}, 42: DUMMY_OBJ}),
+        ([DUMMY_OBJ, {"id": "a"}], {42: DUMMY_OBJ, "a": {"id": "a"}}),
+        ([[{"id": "a"}], ({"id": "b"},)], {"a": {"id": "a"}, "b": {"id": "b"}}),
+        (
+            [{"id": "a"}, [{"id": "b"}], {"id": "c"}],
+            {"a": {"id": "a"}, "b": {"id": "b"}, "c": {"id": "c"}},
+        ),
     ],
 )
 def test_idfy(data, expected_idfy):
     assert nanos.data.idfy(data) == expected_idfy
 
 
+class IterableRecord:
+    def __init__(self, id):
+        self.id = id
+
+    def __iter__(self):
+        yield from vars(self).items()
+
+
+@pytest.mark.parametrize("record", [mock.MagicMock(id=42), IterableRecord(42)])
+def test__idfy__iterable_record(record):
+    assert_that(nanos.data.idfy(record), equal_to({42: record}))
+    assert_that(nanos.data.idfy([record, {"id": 1}]), equal_to({42: record, 1: {"id": 1}}))
+
+
+@pytest.mark.parametrize("id_field_name", ["index", "count", "copy", "pop"])
+@pytest.mark.parametrize("container", [list, tuple, iter, lambda items: (i for i in items)])
+def test__idfy__id_field_named_as_method(container, id_field_name):
+    records = [{id_field_name: 1}, {id_field_name: 2}]
+
+    result = nanos.data.idfy(container(records), id_field_name)
+
+    assert_that(result, equal_to({1: records[0], 2: records[1]}))
+
+
+def test__idfy__custom_id_field():
+    users = [{"pk": 1, "name": "Alice"}, {"pk": 2, "name": "Bob"}]
+    assert_that(nanos.data.idfy(users, "pk"), equal_to({1: users[0], 2: users[1]}))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"foo": "bar"},
+        [{"id": "a"}, {"foo": "bar"}],
+        [DUMMY_OBJ, object()],
+        "id",
+        object(),
+    ],
+)
+def test__idfy__no_id(data):
+    with pytest.raises(ValueError):
+        nanos.data.idfy(data)
+
+
 @pytest.mark.parametrize(
     "input_obj, expected_output",
     [
@@ -49,3 +109,487 @@ def test_idfy(data, expected_idfy):
 )
 def test__remove_empty_members__default_empty(input_obj, expected_output):
     assert_that(nanos.data.remove_empty_members(input_obj), equal_to(expected_output))
+
+
+@pytest.mark.parametrize(
+    "input_obj, expected_output",
+    [
+        (("a", "", None), ("a",)),
+        (("", [""]), ()),
+        ({"a", ""}, {"a"}),
+        (frozenset({"a", ("", "b")}), frozenset({"a", ("b",)})),
+        ({"foo": ("", {"bar": None}), "baz": {("a", "")}}, {"foo": (), "baz": {("a",)}}),
+        (OrderedDict(foo="", bar=1), OrderedDict(bar=1)),
+        (MappingProxyType({"foo": "", "bar": 1}), {"bar": 1}),
+        (Point("", None), Point("", None)),
+    ],
+)
+def test__remove_empty_members__containers(input_obj, expected_output):
+    assert_that(nanos.data.remove_empty_members(input_obj), equal_to(expected_output))
+
+
+def test__remove_empty_members__immutable_mapping_rebuilt_as_dict():
+    cleaned = nanos.data.remove_empty_members([MappingProxyType({"foo": "", "bar": 1})])
+    assert_that(type(cleaned[0]), equal_to(dict))
+
+
+def test__remove_empty_members__custom_empty():
+    obj = {"foo": 0, "bar": [0, 1, ""], "baz": ""}
+    assert_that(nanos.data.remove_empty_members(obj, [0]), equal_to({"bar": [1, ""], "baz": ""}))
+
+
+def test__remove_empty_members__custom_empty_keeps_none():
+    obj = {"a": [0, 1], "b": None}
+    assert_that(nanos.data.remove_empty_members(obj, [0]), equal_to({"a": [1], "b": None}))
+
+
+def test__remove_empty_members__predicate():
+    obj = {"foo": 0, "bar": [-1, 1, ""], "baz": {"qux": -2}}
+
+    cleaned = nanos.data.remove_empty_members(obj, predicate=lambda value: value == -1)
+
+    assert_that(cleaned, equal_to({"foo": 0, "bar": [1], "baz": {"qux": -2}}))
+
+
+@pytest.mark.parametrize(
+    "empty",
+    [
+        nanos.data.EMPTY_VALUES,
+        [0, "", [0], {"a": 1}, set(), ()],
+        [False, b""],
+    ],
+)
+def test__remove_empty_members__same_as_membership(empty):
+    values = [
+        0, 0.0, 1, True, False, "", "a", b"", None, [], {}, OrderedDict(), set(), frozenset(),
+        (), Point(1, 2), object(),
+    ]  # fmt: skip
+
+    for value in values:
+        expected = None if value in empty else value
+        assert_that(nanos.data.remove_empty_members(value, empty), equal_to(expected))
+
+
+@pytest.mark.parametrize("copy", [False, True])
+def test__remove_empty_members__deep_nesting(copy):
+    depth = 10_000
+    obj = {"leaf": ["", 1]}
+    for _ in range(depth):
+        obj = {"foo": [obj, ""], "bar": None}
+
+    cleaned = nanos.data.remove_empty_members(obj, copy=copy)
+
+    for _ in range(depth):
+        cleaned = cleaned["foo"][0]
+    assert_that(cleaned, equal_to({"leaf": [1]}))
+
+
+def test__remove_empty_members__in_place():
+    nested = ["", "a"]
+    obj = {"foo": "", "bar": nested, "baz": defaultdict(list, a=[])}
+
+    cleaned = nanos.data.remove_empty_members(obj)
+
+    assert_that(cleaned is obj, equal_to(True))
+    assert_that(cleaned["bar"] is nested, equal_to(True))
+    assert_that(obj, equal_to({"bar": ["a"]}))
+
+
+def test__remove_empty_members__copy():
+    obj = {"foo": "", "bar": ["", "a"], "baz": defaultdict(list, a=[], b=[1]), "qux": {"", 1}}
+
+    cleaned = nanos.data.remove_empty_members(obj, copy=True)
+
+    assert_that(cleaned, equal_to({"bar": ["a"], "baz": {"b": [1]}, "qux": {1}}))
+    assert_that(type(cleaned["baz"]), equal_to(defaultdict))
+    assert_that(
+        obj,
+        equal_to({"foo": "", "bar": ["", "a"], "baz": {"a": [], "b": [1]}, "qux": {"", 1}}),
+    )
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        '{"foo": "", "bar": [1, "", null, {"baz": []}], "qux": {"a": {}, "b": "\\u00e9"}}',
+        '[{"a": [[], {}, [""]]}, 0, false, 1.5e3, "x"]',
+        '{"foo": {"bar": {"baz": null}}}',
+        '{"a": "\\"quoted\\" \\\\ text", "b": "", "c": [true, {"d": ""}]}',
+        '""',
+        "[]",
+        "12",
+    ],
+)
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test__remove_empty_members_stream(document, chunk_size):
+    src, dst = io.StringIO(document), io.StringIO()
+
+    nanos.data.remove_empty_members_stream(src, dst, chunk_size=chunk_size)
+
+    expected = nanos.data.remove_empty_members(json.loads(document))
+    assert_that(json.loads(dst.getvalue()), equal_to(expected))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 64])
+def test__remove_empty_members_stream__long_strings(chunk_size):
+    # escapes fall on chunk boundaries, and strings are many times longer than a chunk
+    text = 'a\\"\\\\b' * 20_000
+    document = json.dumps({"a": text, "b": ["", text[:5] + "\\"], "c": ""})
+    src, dst = io.StringIO(document), io.StringIO()
+
+    nanos.data.remove_empty_members_stream(src, dst, chunk_size=chunk_size)
+
+    assert_that(json.loads(dst.getvalue()), equal_to({"a": text, "b": [text[:5] + "\\"]}))
+
+
+def test__remove_empty_members_stream__binary():
+    src, dst = io.BytesIO('{"name": "Łódź", "bio": "", "tags": ["ü", ""]}'.encode()), io.BytesIO()
+
+    nanos.data.remove_empty_members_stream(src, dst, chunk_size=3)
+
+    assert_that(dst.getvalue().decode(), equal_to('{"name":"Łódź","tags":["ü"]}'))
+
+
+def test__remove_empty_members_stream__custom_empty():
+    src, dst = io.StringIO('{"a": 0, "b": false, "c": "n/a", "d": [], "e": [0, 1]}'), io.StringIO()
+
+    nanos.data.remove_empty_members_stream(src, dst, [0, "n/a"], predicate=lambda v: v == 1)
+
+    assert_that(dst.getvalue(), equal_to('{"d":[],"e":[]}'))
+
+
+@pytest.mark.parametrize(
+    "document",
+    ['{"a": 1', '{"a" 1}', "[1, 2,]", "[1 2]", '{"a": tru}', "[1]]", '"abc', "{1: 2}", ""],
+)
+def test__remove_empty_members_stream__invalid_json(document):
+    with pytest.raises(ValueError):
+        nanos.data.remove_empty_members_stream(io.StringIO(document), io.StringIO())
+
+
+def test__remove_empty_members_stream__non_empty_container():
+    with pytest.raises(ValueError):
+        nanos.data.remove_empty_members_stream(io.StringIO("[]"), io.StringIO(), [[None]])
+
+
+@pytest.mark.parametrize(
+    "seq, budget, expected_chunks",
+    [
+        ([], 5, []),
+        (["aa", "bbb", "c", "dddd"], 5, [["aa", "bbb"], ["c", "dddd"]]),
+        (["aa", "bbb", "c"], 6, [["aa", "bbb", "c"]]),
+        (["aaaaaaa", "b", "cc"], 5, [["aaaaaaa"], ["b", "cc"]]),
+    ],
+)
+def test__chunker__weighted(seq, budget, expected_chunks):
+    assert_that(nanos.data.chunker(seq, budget, weight=len), equal_to(expected_chunks))
+    assert_that(list(nanos.data.ichunker(seq, budget, weight=len)), equal_to(expected_chunks))
+
+
+def test__chunker__packed():
+    seq = ["aaaa", "bbb", "cc", "d", "eeee", "f"]
+
+    chunks = nanos.data.chunker(seq, 5, weight=len, pack=True)
+
+    assert_that(chunks, equal_to([["aaaa", "d"], ["eeee", "f"], ["bbb", "cc"]]))
+
+
+def test__chunker__pack_without_weight():
+    with pytest.raises(ValueError):
+        nanos.data.chunker([1, 2], 1, pack=True)
+
+
+def test__ichunker__weighted_views():
+    with pytest.raises(ValueError):
+        nanos.data.ichunker(b"abc", 2, views=True, weight=len)
+
+
+@pytest.mark.parametrize(
+    "iterable, size, expected_chunks",
+    [
+        ([], 3, []),
+        (range(5), 5, [[0, 1, 2, 3, 4]]),
+        (range(7), 3, [[0, 1, 2], [3, 4, 5], [6]]),
+        (iter("abcd"), 2, [["a", "b"], ["c", "d"]]),
+        (dummy_generator(), 1, [[{"id": 1, "field": "1"}], [{"id": 2, "field": "2"}]]),
+    ],
+)
+def test__ichunker(iterable, size, expected_chunks):
+    assert_that(list(nanos.data.ichunker(iterable, size)), equal_to(expected_chunks))
+
+
+def test__ichunker__is_lazy():
+    consumed = []
+
+    def source():
+        for number in range(10):
+            consumed.append(number)
+            yield number
+
+    chunks = nanos.data.ichunker(source(), 3)
+
+    assert_that(next(chunks), equal_to([0, 1, 2]))
+    assert_that(consumed, equal_to([0, 1, 2]))
+
+
+@pytest.mark.parametrize("size", [0, -1])
+def test__ichunker__invalid_size(size):
+    with pytest.raises(ValueError):
+        nanos.data.ichunker([1, 2], size)
+
+
+def test__ichunker__views_of_bytes():
+    data = bytearray(b"abcde")
+
+    chunks = list(nanos.data.ichunker(data, 2, views=True))
+    data[0] = ord("z")
+
+    assert_that(all(isinstance(chunk, memoryview) for chunk in chunks), equal_to(True))
+    assert_that([bytes(chunk) for chunk in chunks], equal_to([b"zb", b"cd", b"e"]))
+
+
+def test__ichunker__views_of_array():
+    chunks = nanos.data.ichunker(array.array("i", range(5)), 2, views=True)
+    assert_that([chunk.tolist() for chunk in chunks], equal_to([[0, 1], [2, 3], [4]]))
+
+
+def test__ichunker__views_of_sequence():
+    chunks = nanos.data.ichunker((1, 2, 3), 2, views=True)
+    assert_that(list(chunks), equal_to([(1, 2), (3,)]))
+
+
+def test__ichunker__views_of_iterator():
+    with pytest.raises(TypeError):
+        nanos.data.ichunker(iter([1, 2, 3]), 2, views=True)
+
+
+async def async_source(items, delays=None):
+    for item, delay in zip(items, delays or [0] * len(items), strict=True):
+        await asyncio.sleep(delay)
+        yield item
+
+
+async def collect_chunks(aiterable, size, max_wait=None):
+    return [chunk async for chunk in nanos.data.achunker(aiterable, size, max_wait)]
+
+
+@pytest.mark.parametrize(
+    "items, size, max_wait, expected_chunks",
+    [
+        ([], 2, None, []),
+        ([1, 2, 3, 4, 5], 2, None, [[1, 2], [3, 4], [5]]),
+        ([1, 2, 3], 3, None, [[1, 2, 3]]),
+        ([], 2, 1.0, []),
+        ([1, 2, 3, 4, 5], 2, 1.0, [[1, 2], [3, 4], [5]]),
+    ],
+)
+def test__achunker(items, size, max_wait, expected_chunks):
+    chunks = asyncio.run(collect_chunks(async_source(items), size, max_wait))
+    assert_that(chunks, equal_to(expected_chunks))
+
+
+def test__achunker__flushes_on_deadline():
+    source = async_source([1, 2, 3, 4], delays=[0, 0, 0.2, 0])
+
+    chunks = asyncio.run(collect_chunks(source, 10, max_wait=0.05))
+
+    assert_that(chunks, equal_to([[1, 2], [3, 4]]))
+
+
+def test__achunker__invalid_size():
+    with pytest.raises(ValueError):
+        asyncio.run(collect_chunks(async_source([1]), 0))
+
+
+@pytest.mark.parametrize("executor", ["inline", "thread", "process"])
+def test__chunk_map(executor):
+    results = list(nanos.data.chunk_map(sum, range(10), 3, executor=executor, max_workers=2))
+
+    assert_that([r.index for r in results], equal_to([0, 1, 2, 3]))
+    assert_that([r.result for r in results], equal_to([3, 12, 21, 9]))
+    assert_that(all(r.elapsed >= 0 for r in results), equal_to(True))
+
+
+def test__chunk_map__completion_order():
+    results = nanos.data.chunk_map(sum, range(10), 3, ordered=False, max_workers=2)
+    assert_that(
+        sorted((r.index, r.result) for r in results), equal_to([(0, 3), (1, 12), (2, 21), (3, 9)])
+    )
+
+
+def test__chunk_map__external_executor_is_not_shut_down():
+    with ThreadPoolExecutor(1) as executor:
+        results = list(nanos.data.chunk_map(len, "abcde", 2, executor=executor))
+        assert_that(executor.submit(len, "ab").result(), equal_to(2))
+    assert_that([r.result for r in results], equal_to([2, 2, 1]))
+
+
+def test__chunk_map__bounds_chunks_in_flight():
+    consumed = []
+
+    def source():
+        for number in range(100):
+            consumed.append(number)
+            yield number
+
+    results = nanos.data.chunk_map(list, source(), 2, max_workers=2, max_in_flight=3)
+    first = next(results)
+
+    assert_that(first.result, equal_to([0, 1]))
+    assert_that(len(consumed), equal_to(8))
+    results.close()
+
+
+@pytest.mark.parametrize("max_in_flight", [0, -1])
+@pytest.mark.parametrize("executor", ["thread", "inline"])
+def test__chunk_map__invalid_max_in_flight(max_in_flight, executor):
+    with pytest.raises(ValueError):
+        nanos.data.chunk_map(sum, [1], 1, executor=executor, max_in_flight=max_in_flight)
+
+
+USERS = [
+    {"id": 1, "org": "a", "role": "admin"},
+    {"id": 2, "org": "b", "role": "user"},
+    {"id": 3, "org": "a", "role": "user"},
+    {"id": 1, "org": "c", "role": "user"},
+]
+
+
+@pytest.mark.parametrize(
+    "on_duplicate, expected_index",
+    [
+        ("last", {1: USERS[3], 2: USERS[1], 3: USERS[2]}),
+        ("first", {1: USERS[0], 2: USERS[1], 3: USERS[2]}),
+    ],
+)
+def test__index_by__on_duplicate(on_duplicate, expected_index):
+    assert_that(nanos.data.index_by(USERS, on_duplicate=on_duplicate), equal_to(expected_index))
+
+
+def test__index_by__duplicate_error():
+    with pytest.raises(ValueError, match="Duplicate key 1"):
+        nanos.data.index_by(USERS, on_duplicate="error")
+
+
+@pytest.mark.parametrize(
+    "key, expected_keys",
+    [
+        ("role", ["admin", "user"]),
+        (("org",), [("a",), ("b",), ("c",)]),
+        (("org", "role"), [("a", "admin"), ("b", "user"), ("a", "user"), ("c", "user")]),
+        (lambda user: user["id"] * 10, [10, 20, 30]),
+    ],
+)
+def test__index_by__key(key, expected_keys):
+    assert_that(list(nanos.data.index_by(USERS, key)), equal_to(expected_keys))
+
+
+def test__index_by__objects():
+    objects = [mock.Mock(id=1, org="a"), mock.Mock(id=2, org="a")]
+    index = nanos.data.index_by(iter(objects), ("org", "id"))
+    assert_that(index, equal_to({("a", 1): objects[0], ("a", 2): objects[1]}))
+
+
+@pytest.mark.parametrize(
+    "items", [[{"id": 1}, {"foo": 2}], [object()], [{"id": 1}, None], [{"id": [1]}]]
+)
+def test__index_by__missing_key(items):
+    with pytest.raises(ValueError):
+        nanos.data.index_by(items)
+
+
+def test__group_by__unhashable_key():
+    with pytest.raises(ValueError):
+        nanos.data.group_by([{"org": ["a"]}], "org")
+
+
+def test__group_by():
+    groups = nanos.data.group_by(USERS, "org")
+    assert_that(groups, equal_to({"a": [USERS[0], USERS[2]], "b": [USERS[1]], "c": [USERS[3]]}))
+
+
+def test__group_by__composite_key():
+    groups = nanos.data.group_by(USERS, ("org", "role"))
+    assert_that(
+        list(groups), equal_to([("a", "admin"), ("b", "user"), ("a", "user"), ("c", "user")])
+    )
+
+
+def test__group_by__empty():
+    assert_that(nanos.data.group_by(iter([]), "org"), equal_to({}))
+
+
+class TestIndexedCollection:
+    @pytest.fixture
+    def users(self):
+        return nanos.data.IndexedCollection(
+            [dict(user) for user in USERS[:3]], indexes={"org": "org", "org_role": ("org", "role")}
+        )
+
+    def test__mapping(self, users) -> None:
+        assert_that(len(users), equal_to(3))
+        assert_that(list(users), equal_to([1, 2, 3]))
+        assert_that(users[2], equal_to(USERS[1]))
+        assert_that(2 in users, equal_to(True))
+        assert_that(users.get(4), equal_to(None))
+        assert_that(dict(users), equal_to(nanos.data.idfy(USERS[:3])))
+
+    def test__lookup(self, users) -> None:
+        assert_that(users.lookup("org", "a"), equal_to([USERS[0], USERS[2]]))
+        assert_that(users.lookup("org_role", ("a", "user")), equal_to([USERS[2]]))
+        assert_that(users.lookup("org", "z"), equal_to([]))
+
+    def test__upsert__new_item(self, users) -> None:
+        users.upsert({"id": 4, "org": "b", "role": "user"})
+
+        assert_that(len(users), equal_to(4))
+        assert_that([user["id"] for user in users.lookup("org", "b")], equal_to([2, 4]))
+
+    def test__upsert__existing_item(self, users) -> None:
+        users.upsert({"id": 1, "org": "b", "role": "user"})
+
+        assert_that(len(users), equal_to(3))
+        assert_that([user["id"] for user in users.lookup("org", "a")], equal_to([3]))
+        assert_that([user["id"] for user in users.lookup("org", "b")], equal_to([2, 1]))
+
+    def test__upsert__modified_in_place(self, users) -> None:
+        user = users[3]
+        user["org"] = "b"
+
+        users.upsert(user)
+
+        assert_that([user["id"] for user in users.lookup("org", "a")], equal_to([1]))
+        assert_that([user["id"] for user in users.lookup("org", "b")], equal_to([2, 3]))
+
+    def test__upsert__no_key(self, users) -> None:
+        with pytest.raises(ValueError):
+            users.upsert({"org": "a"})
+
+    @pytest.mark.parametrize(
+        "item", [{"id": 1, "org": ["a"], "role": "user"}, {"id": [1], "org": "a", "role": "user"}]
+    )
+    def test__upsert__unhashable_key(self, users, item) -> None:
+        with pytest.raises(ValueError):
+            users.upsert(item)
+
+        assert_that(users[1], equal_to(USERS[0]))
+        assert_that(users.lookup("org", "a"), equal_to([USERS[0], USERS[2]]))
+        assert_that(users.remove(1), equal_to(USERS[0]))
+
+    def test__remove(self, users) -> None:
+        removed = users.remove(2)
+
+        assert_that(removed, equal_to(USERS[1]))
+        assert_that(2 in users, equal_to(False))
+        assert_that(users.lookup("org", "b"), equal_to([]))
+        with pytest.raises(KeyError):
+            users.remove(2)
+
+    def test__objects_without_secondary_indexes(self) -> None:
+        objects = [mock.Mock(id=1), mock.Mock(id=2)]
+        collection = nanos.data.IndexedCollection(objects)
+
+        collection.remove(1)
+
+        assert_that(list(collection.values()), equal_to([objects[1]]))
+        assert_that(repr(collection), equal_to("<IndexedCollection [key='id', items=1]>"))
@@ -0,0 +1,492 @@
+import asyncio
+import sys
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+import pytest
+from hamcrest import (
+    assert_that,
+    contains_string,
+    equal_to,
+    greater_than,
+    has_item,
+    matches_regexp,
+    not_,
+)
+
+from nanos import debug
+
+linux_only = pytest.mark.skipif(sys.platform != "linux", reason="reads /proc")
+
+
+@linux_only
+def test__get_current_memory_usage():
+    before = debug.get_current_memory_usage()
+    data = bytearray(50 * 1024 * 1024)
+
+    assert_that(debug.get_current_memory_usage() - before, greater_than(40 * 1024 * 1024))
+    del data
+
+
+@linux_only
+def test__reset_peak_memory_usage():
+    data = bytearray(50 * 1024 * 1024)
+    del data
+
+    assert_that(debug.reset_peak_memory_usage(), equal_to(True))
+    peak = debug.get_peak_memory_usage()
+    assert_that(peak - debug.get_current_memory_usage() < 40 * 1024 * 1024, equal_to(True))
+
+
+def test__memory_usage__fallback(tmp_path):
+    missing = str(tmp_path / "missing" / "file")
+    with (
+        mock.patch.multiple(
+            debug, PROC_STATM=missing, PROC_STATUS=missing, PROC_CLEAR_REFS=missing
+        ),
+        mock.patch.object(debug, "get_memory_usage", return_value=1024.0),
+    ):
+        assert_that(debug.get_current_memory_usage(), equal_to(1024))
+        assert_that(debug.get_peak_memory_usage(), equal_to(1024))
+        assert_that(debug.reset_peak_memory_usage(), equal_to(False))
+
+
+def test__memory_profiler():
+    writer = mock.Mock()
+
+    with debug.memory_profiler("block", writer=writer):
+        data = bytearray(10 * 1024 * 1024)
+        del data
+
+    writer.assert_called_once()
+    assert_that(
+        writer.call_args.args[0],
+        matches_regexp(
+            r"^Memory Profiler block [\d.]+ MiB -> [\d.]+ MiB \(Δ-?[\d.]+ \w+, peak [\d.]+ MiB\)$"
+        ),
+    )
+
+
+@linux_only
+def test__memory_profiler__ignores_earlier_peak():
+    data = bytearray(100 * 1024 * 1024)
+    del data
+    peak = debug.get_memory_usage()
+
+    with debug.memory_profiler(writer=mock.Mock()) as profiler:
+        ...
+
+    profile = profiler.profile
+    assert_that(debug.get_memory_usage(), equal_to(peak))
+    assert_that(profile.peak, equal_to(max(profile.start, profile.end)))
+
+
+@linux_only
+def test__memory_profiler__raised_process_peak():
+    spike = debug.get_peak_memory_usage() - debug.get_current_memory_usage() + 50 * 1024 * 1024
+
+    with debug.memory_profiler(writer=mock.Mock()) as profiler:
+        data = bytearray(spike)
+        del data
+
+    profile = profiler.profile
+    assert_that(profile.peak - max(profile.start, profile.end), greater_than(40 * 1024 * 1024))
+
+
+@linux_only
+def test__memory_profiler__reset_peak():
+    data = bytearray(100 * 1024 * 1024)
+    del data
+
+    with debug.memory_profiler(writer=mock.Mock(), reset_peak=True) as profiler:
+        ...
+
+    profile = profiler.profile
+    assert_that(profile.peak - max(profile.start, profile.end) < 50 * 1024 * 1024, equal_to(True))
+    assert_that(profile.peak >= max(profile.start, profile.end), equal_to(True))
+
+
+def test__memory_profiler__sampled_peak():
+    with debug.memory_profiler(writer=mock.Mock(), sample_interval=0.001) as profiler:
+        time.sleep(0.01)
+
+    profile = profiler.profile
+    assert_that(profile.peak, equal_to(max(profile.start, profile.end, profile.sampler.peak)))
+
+
+def test__memory_profiler__trace_allocations():
+    lines = []
+
+    with debug.memory_profiler(writer=lines.append, trace_allocations=True, top=1):
+        data = [bytearray(1024) for _ in range(1024)]
+
+    assert_that(len(lines), equal_to(2))
+    assert_that(
+        lines[1], matches_regexp(r"^Python allocations Δ1\.\d+ MiB, peak 1\.\d+ MiB, top 1:\n")
+    )
+    assert_that(lines[1], contains_string(f"{__file__}:"))
+    assert_that(len(lines[1].splitlines()), equal_to(2))
+    assert_that(tracemalloc.is_tracing(), equal_to(False))
+    del data
+
+
+def test__memory_profiler__already_tracing():
+    tracemalloc.start()
+    try:
+        with debug.memory_profiler(writer=mock.Mock(), trace_allocations=True):
+            ...
+        assert_that(tracemalloc.is_tracing(), equal_to(True))
+    finally:
+        tracemalloc.stop()
+
+
+def test__memory_profiler__sampling():
+    lines = []
+
+    with debug.memory_profiler(writer=lines.append, sample_interval=0.001):
+        time.sleep(0.02)
+
+    assert_that(len(lines), equal_to(2))
+    assert_that(
+        lines[1],
+        matches_regexp(
+            r"^Memory samples \d+ every 0.001s: peak [\d.]+ MiB at [\d.]+s, mean [\d.]+ MiB$"
+        ),
+    )
+
+
+def test__memory_profiler__exception_stops_sampler():
+    with (
+        pytest.raises(RuntimeError),
+        debug.memory_profiler(writer=mock.Mock(), sample_interval=0.001),
+    ):
+        raise RuntimeError
+
+    sampler_threads = [t for t in threading.enumerate() if t.name == "nanos-memory-sampler"]
+    assert_that(sampler_threads, equal_to([]))
+
+
+class TestMemorySampler:
+    def test__ring_buffer(self):
+        rss = iter([100, 300, 400, 50, 10, 20])
+        sampler = debug.MemorySampler(interval=10, capacity=2, gc_counts=True)
+
+        with mock.patch.object(debug, "_read_statm", side_effect=lambda fd: next(rss)):
+            with sampler:
+                sampler._sample()
+                sampler._sample()
+
+            assert_that(sampler.count, equal_to(4))
+            assert_that([sample.rss for sample in sampler.samples()], equal_to([400, 50]))
+            assert_that(len(sampler.samples()[0].gc_counts), equal_to(3))
+            assert_that((sampler.peak, sampler.mean), equal_to((400, 212.5)))
+            assert_that(sampler.peak_time, equal_to(sampler.samples()[0].time))
+
+            with sampler:
+                ...
+
+        assert_that((sampler.count, sampler.peak, sampler.mean), equal_to((2, 20, 15.0)))
+
+    def test__background_sampling(self):
+        with debug.MemorySampler(interval=0.001) as sampler:
+            time.sleep(0.05)
+
+        samples = sampler.samples()
+        assert_that(sampler.count, greater_than(5))
+        assert_that(samples[0].gc_counts, equal_to(()))
+        assert_that(samples[0].time <= samples[-1].time, equal_to(True))
+        assert_that(sampler.peak, greater_than(0))
+
+    def test__collapsed_while_sampling(self):
+        # new threads add new stacks while the sampler is running
+        threads = [threading.Thread(target=busy_wait, args=(0.001,)) for _ in range(50)]
+        with debug.StackSampler(interval=0.0001) as sampler:
+            for thread in threads:
+                thread.start()
+                sampler.collapsed()
+                thread.join()
+
+        assert_that(sampler.samples, greater_than(0))
+
+    def test__start_twice(self):
+        with debug.MemorySampler(interval=10) as sampler, pytest.raises(RuntimeError):
+            sampler.start()
+
+    @pytest.mark.parametrize("kwargs", [{"interval": 0}, {"capacity": 0}])
+    def test__invalid(self, kwargs):
+        with pytest.raises(ValueError):
+            debug.MemorySampler(**kwargs)
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class TestStackSampler:
+    def test__sampling(self):
+        with debug.StackSampler(interval=0.001) as sampler:
+            busy_wait(0.05)
+
+        lines = sampler.collapsed()
+        assert_that(sampler.samples, greater_than(5))
+        assert_that("\n".join(lines), contains_string("busy_wait (test_debug.py:"))
+        assert_that(lines[0], matches_regexp(r"^MainThread;.+ \d+$"))
+        assert_that(lines[0].endswith(f" {max(sampler.stacks.values())}"), equal_to(True))
+        assert_that("\n".join(lines).count("nanos-stack-sampler"), equal_to(0))
+
+    def test__other_threads(self):
+        thread = threading.Thread(target=busy_wait, args=(0.05,), name="worker")
+        with debug.StackSampler(interval=0.001) as sampler:
+            thread.start()
+            thread.join()
+
+        assert_that(
+            any(line.startswith("worker;") and "busy_wait" in line for line in sampler.collapsed()),
+            equal_to(True),
+        )
+
+    def test__max_depth(self):
+        sampler = debug.StackSampler(max_depth=1)
+
+        sampler._sample(own_ident=0)
+
+        assert_that(
+            all(line.count(";") == 1 for line in sampler.collapsed()),
+            equal_to(True),
+        )
+        assert_that(sampler.samples, equal_to(1))
+
+    def test__write_and_save(self, tmp_path):
+        sampler = debug.StackSampler()
+        sampler._sample(own_ident=0)
+        lines = []
+
+        sampler.write(lines.append)
+        sampler.save(tmp_path / "stacks.folded")
+
+        assert_that(lines, equal_to(sampler.collapsed()))
+        assert_that((tmp_path / "stacks.folded").read_text().splitlines(), equal_to(lines))
+
+    def test__start_twice(self):
+        with debug.StackSampler(interval=10) as sampler, pytest.raises(RuntimeError):
+            sampler.start()
+
+    @pytest.mark.parametrize("kwargs", [{"interval": 0}, {"max_depth": 0}])
+    def test__invalid(self, kwargs):
+        with pytest.raises(ValueError):
+            debug.StackSampler(**kwargs)
+
+
+def test__sample_stacks():
+    lines = []
+
+    sampler = debug.sample_stacks(0.01, interval=0.001, writer=lines.append)
+
+    assert_that(lines, equal_to(sampler.collapsed()))
+
+
+def make_profile(description="block", start=100, end=150, peak=200, **kwargs):
+    return debug.MemoryProfile(description, start, end, peak, **kwargs)
+
+
+class TestMemoryProfiler:
+    def test__context_manager(self):
+        sink = mock.Mock()
+
+        with debug.MemoryProfiler("block", [sink], trace_allocations=True) as profiler:
+            data = [bytearray(1024) for _ in range(1024)]
+
+        profile = profiler.profile
+        sink.assert_called_once_with(profile)
+        assert_that(profile.description, equal_to("block"))
+        assert_that(profile.delta, equal_to(profile.end - profile.start))
+        assert_that(profile.peak >= max(profile.start, profile.end), equal_to(True))
+        assert_that(profile.allocations.size, greater_than(1024 * 1024))
+        assert_that(profile.allocations.top[0].location, contains_string(f"{__file__}:"))
+        del data
+
+    def test__async_context_manager(self):
+        async def main():
+            async with debug.MemoryProfiler(sample_interval=0.001) as profiler:
+                await asyncio.sleep(0.01)
+            return profiler.profile
+
+        profile = asyncio.run(main())
+        assert_that(profile.sampler.count, greater_than(1))
+        assert_that(profile.allocations, equal_to(None))
+
+    def test__decorator(self):
+        aggregator = debug.MemoryAggregator()
+        profiler = debug.MemoryProfiler(sinks=[aggregator])
+
+        @profiler
+        def allocate(size):
+            return bytearray(size)
+
+        @debug.MemoryProfiler("fetch", [aggregator])
+        async def fetch():
+            return "done"
+
+        assert_that(len(allocate(10)), equal_to(10))
+        allocate(20)
+        assert_that(asyncio.run(fetch()), equal_to("done"))
+
+        summary = aggregator.summary()
+        name = f"{__name__}.TestMemoryProfiler.test__decorator.<locals>.allocate"
+        assert_that(sorted(summary), equal_to(sorted([name, "fetch"])))
+        assert_that(summary[name]["count"], equal_to(2))
+        assert_that(profiler.profile, equal_to(None))
+
+    def test__exception(self):
+        sink = mock.Mock()
+
+        with pytest.raises(RuntimeError), debug.MemoryProfiler(sinks=[sink]) as profiler:
+            raise RuntimeError
+
+        sink.assert_not_called()
+        assert_that(profiler.profile.description, equal_to(""))
+
+
+class TestMemoryProfile:
+    def test__sections(self):
+        allocations = debug.Allocations(2048, 4096, (debug.AllocationSite("app.py:1", 2048, 2),))
+        profile = make_profile(allocations=allocations)
+
+        assert_that(
+            profile.sections(),
+            equal_to(
+                [
+                    "Memory Profiler block 100.00 B -> 150.00 B (Δ50.00 B, peak 200.00 B)",
+                    "Python allocations Δ2.00 KiB, peak 4.00 KiB, top 1:\n"
+                    "  app.py:1: Δ2.00 KiB (+2 blocks)",
+                ]
+            ),
+        )
+
+    def test__to_dict(self):
+        allocations = debug.Allocations(10, 20, (debug.AllocationSite("app.py:1", 10, 1),))
+
+        assert_that(
+            make_profile(allocations=allocations).to_dict(),
+            equal_to(
+                {
+                    "description": "block",
+                    "start": 100,
+                    "end": 150,
+                    "delta": 50,
+                    "peak": 200,
+                    "allocations": {
+                        "size": 10,
+                        "peak": 20,
+                        "top": [{"location": "app.py:1", "size": 10, "count": 1}],
+                    },
+                }
+            ),
+        )
+
+    def test__text_sink(self):
+        lines = []
+
+        debug.text_sink(lines.append)(make_profile())
+
+        assert_that(lines, equal_to([str(make_profile())]))
+
+
+def test__memory_aggregator():
+    aggregator = debug.MemoryAggregator()
+
+    aggregator(make_profile(end=150, peak=300))
+    aggregator(make_profile(end=90, peak=200, allocations=debug.Allocations(64, 128)))
+    aggregator(make_profile("other"))
+
+    assert_that(
+        aggregator.summary()["block"],
+        equal_to(
+            {
+                "count": 2,
+                "delta_total": 40,
+                "delta_min": -10,
+                "delta_max": 50,
+                "peak_max": 300,
+                "allocations_total": 64,
+                "delta_mean": 20.0,
+            }
+        ),
+    )
+    aggregator.reset()
+    assert_that(aggregator.summary(), equal_to({}))
+
+
+class Leak:
+    pass
+
+
+LEAK_TYPE = f"{__name__}.Leak"
+
+
+def test__count_objects():
+    leaked = [Leak() for _ in range(100)]
+
+    counts = debug.count_objects()
+
+    assert_that(counts[LEAK_TYPE], equal_to(len(leaked)))
+
+
+class TestObjectGrowthTracker:
+    def test__check(self):
+        lines = []
+        leaked = []
+        tracker = debug.ObjectGrowthTracker("worker", lines.append, top=3).start()
+
+        leaked.extend(Leak() for _ in range(1000))
+        previous = tracker.counts.total()
+        growth = tracker.check()
+
+        assert_that(growth.total, equal_to(tracker.counts.total()))
+        assert_that(growth.delta, equal_to(growth.total - previous))
+        assert_that(growth.types[0], equal_to(debug.TypeGrowth(LEAK_TYPE, 1000, 1000)))
+        assert_that(len(growth.types) <= 3, equal_to(True))
+        assert_that(growth.allocations, equal_to(None))
+        assert_that(lines, equal_to([str(growth)]))
+        assert_that(
+            lines[0],
+            matches_regexp(r"^Object growth worker: \d+ objects \(\+\d+\), top \d types:\n"),
+        )
+        assert_that(lines[0], contains_string(f"  {LEAK_TYPE}: 1000 (+1000)"))
+
+    def test__check__since_previous_check(self):
+        leaked = []
+        tracker = debug.ObjectGrowthTracker(writer=lambda line: None).start()
+        leaked.extend(Leak() for _ in range(100))
+        tracker.check()
+
+        growth = tracker.check()
+
+        assert_that(
+            [growth.name for growth in growth.types],
+            not_(has_item(LEAK_TYPE)),
+        )
+
+    def test__tracebacks(self):
+        leaked = []
+        with debug.ObjectGrowthTracker(
+            writer=lambda line: None, tracebacks=True, frames=5
+        ) as tracker:
+            assert_that(tracemalloc.is_tracing(), equal_to(True))
+            leaked.extend(Leak() for _ in range(1000))
+            growth = tracker.check()
+
+        assert_that(tracemalloc.is_tracing(), equal_to(False))
+        assert_that(growth.allocations.size, greater_than(0))
+        assert_that(growth.allocations.top[0].location, contains_string("test_debug.py:"))
+        assert_that(growth.allocations.top[0].location, contains_string(" <- "))
+        assert_that(str(growth), contains_string("Python allocations"))
+
+    @pytest.mark.parametrize("kwargs", [{"top": 0}, {"frames": 0}])
+    def test__invalid(self, kwargs):
+        with pytest.raises(ValueError):
+            debug.ObjectGrowthTracker(**kwargs)
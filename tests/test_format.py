@@ -1,3 +1,7 @@
+import random
+import typing as t
+from array import array
+
 import pytest
 from hamcrest import assert_that, equal_to
 
@@ -20,3 +24,166 @@ from nanos import fmt
 )
 def test__size(size_bytes: int, precision: int, expected_format: str) -> None:
     assert_that(fmt.size(size_bytes, precision), equal_to(expected_format))
+
+
+SIZES = [
+    0,
+    1,
+    -1,
+    0.5,
+    -0.0,
+    1023,
+    1023.999,
+    1024,
+    -1024,
+    1050,
+    2**60 - 1,
+    1024**8,
+    1050**9,
+    1e300,
+    5e-324,
+    float("inf"),
+    float("-inf"),
+    float("nan"),
+]
+
+
+@pytest.mark.parametrize("precision", [0, 1, 2, 5])
+def test__sizes(precision: int) -> None:
+    assert_that(
+        fmt.sizes(SIZES, precision),
+        equal_to([fmt.size(size_bytes, precision) for size_bytes in SIZES]),
+    )
+
+
+def test__sizes__array_and_buffer() -> None:
+    values = array("d", [1.5, 1536, 3 * 1024**3])
+    expected = ["1.50 B", "1.50 KiB", "3.00 GiB"]
+
+    assert_that(fmt.sizes(values), equal_to(expected))
+    assert_that(fmt.sizes(memoryview(values)), equal_to(expected))
+
+
+def test__sizes__out() -> None:
+    out = ["", "", "unchanged"]
+
+    result = fmt.sizes([1, 2048], 1, out=out)
+
+    assert_that(result is out, equal_to(True))
+    assert_that(out, equal_to(["1.0 B", "2.0 KiB", "unchanged"]))
+
+
+def test__sizes__short_out() -> None:
+    with pytest.raises(ValueError):
+        fmt.sizes([1, 2], out=[""])
+
+
+@pytest.mark.parametrize(
+    "formatter, value, expected",
+    [
+        (fmt.IEC_SIZE, 1536, "1.50 KiB"),
+        (fmt.SI_SIZE, 1536, "1.54 kB"),
+        (fmt.SI_SIZE, 999, "999.00 B"),
+        (fmt.SI_SIZE, -2.5e12, "-2.50 TB"),
+        (fmt.BITRATE, 1.5e9, "1.50 Gbit/s"),
+        (fmt.DURATION, 0, "0.00 s"),
+        (fmt.DURATION, 2.5e-7, "250.00 ns"),
+        (fmt.DURATION, 0.0015, "1.50 ms"),
+        (fmt.DURATION, 1.5, "1.50 s"),
+        (fmt.DURATION, 3600, "3600.00 s"),
+        (fmt.DURATION, 1e-12, "0.00 ns"),
+        (fmt.COUNT, 12, "12.0"),
+        (fmt.COUNT, 1234567, "1.2M"),
+        (fmt.COUNT, float("nan"), "nanY"),
+    ],
+)
+def test__formatter(formatter: fmt.Formatter, value: float, expected: str) -> None:
+    assert_that(formatter(value), equal_to(expected))
+    assert_that(formatter.many([value]), equal_to([expected]))
+
+
+def test__formatter__pattern() -> None:
+    requests = fmt.Formatter(
+        "req/s", base=1000, prefixes=fmt.SI_PREFIXES, precision=1, pattern="{value}{prefix} {unit}"
+    )
+    percents = fmt.Formatter("%", prefixes=[""], precision=0, pattern="{value}{unit}")
+
+    assert_that(requests.many([12, 1234]), equal_to(["12.0 req/s", "1.2k req/s"]))
+    assert_that(percents(42), equal_to("42%"))
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [{"base": 1}, {"prefixes": []}, {"offset": 9}, {"offset": -1}, {"precision": -1}],
+)
+def test__formatter__invalid(kwargs: dict[str, t.Any]) -> None:
+    with pytest.raises(ValueError):
+        fmt.Formatter(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("0", 0),
+        ("7 B", 7),
+        (" 7b ", 7),
+        ("-1.00 B", -1),
+        ("200kB", 200_000),
+        ("200 KB", 200_000),
+        ("1.5G", 1_500_000_000),
+        ("1.1 kB", 1100),
+        ("512MiB", 512 * 1024**2),
+        ("512 mib", 512 * 1024**2),
+        ("1.50 KiB", 1536),
+        ("2Ki", 2048),
+        (".5k", 500),
+        ("1e3", 1000),
+        ("1.5e-3 kB", 2),
+        ("3 YiB", 3 * 1024**8),
+    ],
+)
+def test__parse_size(text: str, expected: int) -> None:
+    assert_that(fmt.parse_size(text), equal_to(expected))
+
+
+@pytest.mark.parametrize("text", ["", "B", "1 XB", "0x10", "1,5 MB", "1 MB 2", "inf YiB", "nan B"])
+def test__parse_size__invalid(text: str) -> None:
+    with pytest.raises(ValueError):
+        fmt.parse_size(text)
+
+
+@pytest.mark.parametrize("text", ["1e100000000", "1.5e100000", "1e1000 B"])
+def test__parse_size__huge_exponent(text: str) -> None:
+    with pytest.raises(ValueError, match="Invalid size"):
+        fmt.parse_size(text)
+
+
+@pytest.mark.parametrize("precision", [0, 2, 5])
+def test__parse_size__round_trip(precision: int) -> None:
+    rng = random.Random(precision)
+    for _ in range(1000):
+        size_bytes = rng.randrange(-(1024**7), 1024**7) >> rng.randrange(70)
+        text = fmt.size(size_bytes, precision)
+        scale = 1024 ** max((abs(size_bytes).bit_length() - 1) // 10, 0)
+        # size rounds to precision decimal places of the unit, parse_size to bytes
+        tolerance = scale * 0.5 * 10**-precision + 0.5
+
+        assert_that(abs(fmt.parse_size(text) - size_bytes) <= tolerance, equal_to(True), text)
+
+
+@pytest.mark.parametrize("unit", range(len(fmt.IEC_PREFIXES)))
+def test__parse_size__exact_round_trip(unit: int) -> None:
+    rng = random.Random(unit)
+    for _ in range(100):
+        size_bytes = rng.randrange(1024) * 1024**unit
+
+        assert_that(fmt.parse_size(fmt.size(size_bytes, 0)), equal_to(size_bytes))
+
+
+@pytest.mark.parametrize("unit", range(len(fmt.SI_PREFIXES)))
+def test__parse_size__si_round_trip(unit: int) -> None:
+    rng = random.Random(unit)
+    for _ in range(100):
+        size_bytes = rng.randrange(1000) * 1000**unit
+
+        assert_that(fmt.parse_size(fmt.SI_SIZE(size_bytes)), equal_to(size_bytes))
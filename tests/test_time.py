@@ -1,16 +1,34 @@
+import asyncio
+import contextlib
+import itertools
+import math
+import sys
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import pytest
 from hamcrest import assert_that, close_to, equal_to
 
-from nanos.time import Timer
+from nanos.time import (
+    Deadline,
+    DeadlineExceeded,
+    Histogram,
+    Timer,
+    TimerRegistry,
+    current_span,
+    default_registry,
+    timed,
+)
 
 
 @pytest.fixture
 def timer() -> Timer:
     timer_instance = Timer()
-    timer_instance.start = 123.456789
-    timer_instance.end = 987.654321
+    with pytest.warns(DeprecationWarning):
+        timer_instance.start = 123.456789
+        timer_instance.end = 987.654321
     return timer_instance
 
 
@@ -35,8 +53,9 @@ class TestTimer:
     )
     def test__verbose(self, start, end, precision, expected_verbose) -> None:
         timer = Timer(precision=precision)
-        timer.start = start
-        timer.end = end
+        with pytest.warns(DeprecationWarning):
+            timer.start = start
+            timer.end = end
         assert_that(timer.verbose(), equal_to(expected_verbose))
 
     @pytest.mark.parametrize(
@@ -49,25 +68,646 @@ class TestTimer:
         ],
     )
     def test__elapsed(self, start: float | None, end: float | None, expected_elapsed: float):
-        with mock.patch("nanos.time.time") as patched_time:
-            timer = Timer()
+        timer = Timer(clock=lambda: 123_456_789_000)
+        with pytest.warns(DeprecationWarning):
             timer.start = start
             timer.end = end
-            patched_time.time.return_value = 123.456789
-            assert_that(timer.elapsed, close_to(expected_elapsed, 0.01))
+        assert_that(timer.elapsed, close_to(expected_elapsed, 0.01))
+
+    def test__start__wall_clock_seconds(self) -> None:
+        timer = Timer()
+
+        with pytest.warns(DeprecationWarning, match="start_ns"):
+            timer.start = time.time() - 1
+
+        assert_that(timer.clock, equal_to(time.time_ns))
+        assert_that(timer.elapsed, close_to(1, 0.5))
+
+    def test__elapsed_ns(self) -> None:
+        timer = Timer()
+        timer.start_ns = 1_000_000_001
+        timer.end_ns = 3_000_000_004
+        assert_that(timer.elapsed_ns, equal_to(2_000_000_003))
+        assert_that(timer.elapsed, equal_to(2.000000003))
 
     def test__context_manager(self) -> None:
-        time_return_value = 123.456789
-        with mock.patch("nanos.time.time") as patched_time:
-            patched_time.time.return_value = time_return_value
-            with Timer() as t:
+        clock = mock.Mock(side_effect=[10, 25])
+        with Timer(clock=clock) as t:
+            ...
+
+        assert_that(t.start_ns, equal_to(10))
+        assert_that(t.end_ns, equal_to(25))
+        assert_that(t.elapsed_ns, equal_to(15))
+        assert_that(clock.call_count, equal_to(2))
+
+    def test__async_context_manager(self) -> None:
+        async def measure() -> Timer:
+            async with Timer(clock=mock.Mock(side_effect=[10, 25])) as t:
                 ...
+            return t
 
-        assert_that(t.start, equal_to(time_return_value))
-        assert_that(t.end, equal_to(time_return_value))
-        assert_that(patched_time.time.call_count, equal_to(2))
+        assert_that(asyncio.run(measure()).elapsed_ns, equal_to(15))
+
+    @pytest.mark.parametrize(
+        "clock, expected",
+        [
+            ("perf_counter", time.perf_counter_ns),
+            ("process_time", time.process_time_ns),
+            ("thread_time", time.thread_time_ns),
+            ("monotonic", time.monotonic_ns),
+            ("time", time.time_ns),
+        ],
+    )
+    def test__clock(self, clock, expected) -> None:
+        assert_that(Timer(clock=clock).clock, equal_to(expected))
+
+    def test__clock__unknown(self) -> None:
+        with pytest.raises(ValueError):
+            Timer(clock="sundial")  # type: ignore[arg-type]
+
+    def test__start_end__seconds(self, timer: Timer) -> None:
+        assert_that(timer.start_ns, equal_to(123_456_789_000))
+        assert_that(timer.end, equal_to(987.654321))
 
     def test__str(self, timer: Timer) -> None:
-        with mock.patch.object(timer, "verbose", return_value="foo"):
+        with mock.patch.object(Timer, "verbose", return_value="foo"):
             assert_that(str(timer), equal_to("foo"))
             timer.verbose.assert_called_once()
+
+    def test__histogram(self) -> None:
+        histogram = Histogram()
+        timer = Timer(clock=mock.Mock(side_effect=[0, 10, 100, 130]), histogram=histogram)
+
+        with timer:
+            ...
+        with timer:
+            assert_that(timer.end_ns, equal_to(None))
+
+        assert_that(histogram.count, equal_to(2))
+        assert_that(histogram.total, equal_to(40))
+
+    def test__pause_resume(self) -> None:
+        timer = Timer(clock=mock.Mock(side_effect=[0, 10, 30, 50, 60, 100]), histogram=Histogram())
+
+        with timer:
+            timer.pause()
+            assert_that(timer.paused, equal_to(True))
+            timer.resume()
+            timer.pause()
+            assert_that(timer.elapsed_ns, equal_to(30))
+
+        assert_that(timer.paused, equal_to(False))
+        assert_that(timer.paused_ns, equal_to(20 + 50))
+        assert_that(timer.elapsed_ns, equal_to(30))
+        assert_that(timer.histogram.total, equal_to(30))
+
+    def test__laps(self) -> None:
+        timer = Timer(clock=mock.Mock(side_effect=[0, 10, 15, 20, 40, 45, 50, 100, 200, 300, 400]))
+
+        with timer:
+            assert_that(timer.lap(), equal_to(10))
+            timer.pause()
+            timer.resume()
+            assert_that(timer.lap(), equal_to(25))
+            timer.pause()
+            assert_that(timer.lap(), equal_to(5))
+            timer.resume()
+
+        assert_that(list(timer.laps), equal_to([10, 25, 5]))
+        assert_that(timer.laps.typecode, equal_to("q"))
+        with timer:
+            ...
+        assert_that(len(timer.laps), equal_to(0))
+
+    def test__lap_stats(self) -> None:
+        timer = Timer(clock=itertools.accumulate(itertools.cycle([1, 2, 3, 4])).__next__)
+
+        with timer:
+            for _ in range(1000):
+                timer.lap()
+
+        assert_that(
+            timer.lap_stats(),
+            equal_to(
+                {
+                    "count": 1000,
+                    "total": 2500,
+                    "mean": 2.5,
+                    "stdev": math.sqrt(1.25),
+                    "min": 1,
+                    "max": 4,
+                    "p50": 2,
+                    "p90": 4,
+                    "p99": 4,
+                }
+            ),
+        )
+        assert_that(Timer().lap_stats()["count"], equal_to(0))
+
+    @pytest.mark.parametrize("method", ["pause", "resume", "lap"])
+    def test__not_running(self, method: str) -> None:
+        timer = Timer()
+
+        with pytest.raises(RuntimeError):
+            getattr(timer, method)()
+        with timer:
+            ...
+        with pytest.raises(RuntimeError):
+            getattr(timer, method)()
+
+    @pytest.mark.parametrize(
+        "calls", [["pause", "pause"], ["resume"], ["pause", "resume", "resume"]]
+    )
+    def test__pause_resume__wrong_state(self, calls: list[str]) -> None:
+        with Timer() as timer:
+            for method in calls[:-1]:
+                getattr(timer, method)()
+            with pytest.raises(RuntimeError):
+                getattr(timer, calls[-1])()
+
+
+class TestHistogram:
+    def test__empty(self) -> None:
+        histogram = Histogram()
+
+        assert_that(
+            histogram.summary(),
+            equal_to(
+                {
+                    "count": 0,
+                    "mean": 0.0,
+                    "min": 0,
+                    "max": 0,
+                    "p50": 0,
+                    "p90": 0,
+                    "p99": 0,
+                    "p999": 0,
+                }
+            ),
+        )
+
+    def test__summary(self) -> None:
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.record(value)
+
+        assert_that(
+            histogram.summary(),
+            equal_to(
+                {
+                    "count": 1000,
+                    "mean": 500.5,
+                    "min": 1,
+                    "max": 1000,
+                    "p50": 502,
+                    "p90": 900,
+                    "p99": 988,
+                    "p999": 996,
+                }
+            ),
+        )
+
+    @pytest.mark.parametrize("bits", [1, 4, 7, 12])
+    def test__relative_error(self, bits: int) -> None:
+        histogram = Histogram(bits)
+        values = [int(1.1**n) for n in range(460)] + [2**64 - 1]
+        for value in values:
+            histogram.record(value)
+
+        for percent in [1, 10, 25, 50, 75, 90, 99, 100]:
+            expected = values[max(1, math.ceil(percent * len(values) / 100)) - 1]
+            actual = histogram.percentile(percent)
+            assert_that(actual, close_to(expected, expected / 2 ** (bits - 1)))
+
+    def test__exact_small_values(self) -> None:
+        histogram = Histogram(bits=4)
+        histogram.record(3, count=5)
+        histogram.record(15)
+
+        assert_that(histogram.percentiles(0, 80, 84, 100), equal_to([3, 3, 15, 15]))
+        assert_that(histogram.mean, equal_to(30 / 6))
+
+    def test__merge_and_reset(self) -> None:
+        first, second = Histogram(), Histogram()
+        first.record(100)
+        second.record(10)
+        second.record(1000)
+
+        first.merge(second)
+
+        assert_that((first.count, first.min, first.max, first.p50), equal_to((3, 10, 1000, 100)))
+        first.reset()
+        assert_that((first.count, first.min, first.max, first.total), equal_to((0, 0, 0, 0)))
+
+    @pytest.mark.parametrize(
+        "call",
+        [
+            lambda: Histogram(bits=0),
+            lambda: Histogram(bits=17),
+            lambda: Histogram().record(-1),
+            lambda: Histogram().percentile(101),
+            lambda: Histogram(bits=5).merge(Histogram(bits=6)),
+        ],
+    )
+    def test__errors(self, call) -> None:
+        with pytest.raises(ValueError):
+            call()
+
+
+class TestTimerRegistry:
+    def test__timer(self) -> None:
+        registry = TimerRegistry(clock=mock.Mock(side_effect=[0, 5, 10, 30, 40, 41]))
+
+        for name in ["foo", "bar", "foo"]:
+            with registry.timer(name):
+                ...
+
+        assert_that(list(registry), equal_to(["foo", "bar"]))
+        assert_that(registry.summary()["foo"]["count"], equal_to(2))
+        assert_that(registry.summary()["foo"]["max"], equal_to(5))
+        assert_that(registry["bar"].total, equal_to(20))
+        assert_that(
+            repr(registry.timer("foo")), equal_to("<Timer [name='foo', start=None, end=None]>")
+        )
+
+    def test__histogram(self) -> None:
+        registry = TimerRegistry(bits=5)
+
+        assert_that(registry.histogram("foo") is registry.histogram("foo"), equal_to(True))
+        assert_that(registry["foo"].bits, equal_to(5))
+        registry.reset()
+        assert_that(len(registry), equal_to(0))
+
+
+class TestTimed:
+    @pytest.fixture
+    def registry(self) -> TimerRegistry:
+        return TimerRegistry(clock=mock.Mock(side_effect=range(0, 1000, 10)))
+
+    def test__function(self, registry: TimerRegistry) -> None:
+        @timed(registry=registry)
+        def double(value: int) -> int:
+            """Doubles the value."""
+            return value * 2
+
+        assert_that([double(1), double(2)], equal_to([2, 4]))
+        assert_that(double.__doc__, equal_to("Doubles the value."))
+        name = f"{__name__}.TestTimed.test__function.<locals>.double"
+        assert_that(registry[name].count, equal_to(2))
+        assert_that(registry[name].total, equal_to(20))
+
+    def test__coroutine_function(self, registry: TimerRegistry) -> None:
+        @timed(name="sleep", registry=registry)
+        async def sleep() -> str:
+            await asyncio.sleep(0)
+            return "done"
+
+        assert_that(asyncio.run(sleep()), equal_to("done"))
+        assert_that(registry["sleep"].count, equal_to(1))
+
+    def test__generator_function(self, registry: TimerRegistry) -> None:
+        @timed(name="gen", registry=registry)
+        def gen() -> t.Generator[int, int, str]:
+            received = yield 1
+            yield received
+            return "done"
+
+        generator = gen()
+        assert_that(next(generator), equal_to(1))
+        assert_that(registry["gen"].count, equal_to(0))
+        assert_that(generator.send(5), equal_to(5))
+        with pytest.raises(StopIteration) as stop:
+            next(generator)
+        assert_that(stop.value.value, equal_to("done"))
+        assert_that(registry["gen"].count, equal_to(1))
+
+    def test__async_generator_function(self, registry: TimerRegistry) -> None:
+        @timed(name="agen", registry=registry)
+        async def agen() -> t.AsyncIterator[int]:
+            for value in range(3):
+                yield value
+
+        async def collect() -> list[int]:
+            return [value async for value in agen()]
+
+        assert_that(asyncio.run(collect()), equal_to([0, 1, 2]))
+        assert_that(registry["agen"].count, equal_to(1))
+
+    @pytest.mark.parametrize("enabled", [True, False])
+    def test__async_generator_function__aclose(
+        self, registry: TimerRegistry, enabled: bool
+    ) -> None:
+        closed = []
+
+        @timed(name="agen", registry=registry)
+        async def agen() -> t.AsyncIterator[int]:
+            try:
+                for value in range(3):
+                    yield value
+            finally:
+                closed.append(True)
+
+        async def first() -> list[bool]:
+            generator = agen()
+            async for _ in generator:
+                break
+            await generator.aclose()
+            # checked before asyncio.run() finalizes the generators left open
+            return list(closed)
+
+        registry.enabled = enabled
+        assert_that(asyncio.run(first()), equal_to([True]))
+
+    def test__generator_function__span_tree(self) -> None:
+        @timed(name="gen", registry=TimerRegistry())
+        def gen() -> t.Generator[int, None, None]:
+            for value in range(2):
+                with Timer(name="produce"):
+                    yield value
+                    with Timer(name="resumed"):
+                        pass
+
+        with Timer(name="request", trace=True) as timer:
+            generator = gen()
+            next(generator)
+            with Timer(name="consume"):
+                assert_that(current_span().name, equal_to("consume"))
+            next(generator)
+            with pytest.raises(ZeroDivisionError):
+                generator.throw(ZeroDivisionError)
+
+        tree = [(depth, span.name) for depth, span in timer.span.walk()]
+        assert_that(
+            tree,
+            equal_to(
+                [
+                    (0, "request"),
+                    (1, "gen"),
+                    (2, "produce"),
+                    (3, "resumed"),
+                    (2, "produce"),
+                    (1, "consume"),
+                ]
+            ),
+        )
+        assert_that(current_span(), equal_to(None))
+
+    def test__async_generator_function__span_tree(self) -> None:
+        @timed(name="agen", registry=TimerRegistry())
+        async def agen() -> t.AsyncIterator[int]:
+            for value in range(2):
+                with Timer(name="produce"):
+                    yield value
+
+        async def request() -> Timer:
+            async with Timer(name="request", trace=True) as timer:
+                async for _ in agen():
+                    with Timer(name="consume"):
+                        pass
+            return timer
+
+        tree = [(depth, span.name) for depth, span in asyncio.run(request()).span.walk()]
+        assert_that(
+            tree,
+            equal_to(
+                [
+                    (0, "request"),
+                    (1, "agen"),
+                    (2, "produce"),
+                    (2, "produce"),
+                    (1, "consume"),
+                    (1, "consume"),
+                ]
+            ),
+        )
+
+    def test__exception(self, registry: TimerRegistry) -> None:
+        @timed(name="fail", registry=registry)
+        def fail() -> None:
+            raise RuntimeError
+
+        with pytest.raises(RuntimeError):
+            fail()
+        assert_that(registry["fail"].count, equal_to(1))
+
+    def test__disabled(self, registry: TimerRegistry) -> None:
+        @timed(name="noop", registry=registry)
+        def noop() -> None: ...
+
+        registry.enabled = False
+        noop()
+
+        assert_that(len(registry), equal_to(0))
+
+    def test__default_registry(self) -> None:
+        @timed
+        def noop() -> None: ...
+
+        noop()
+
+        name = f"{__name__}.TestTimed.test__default_registry.<locals>.noop"
+        assert_that(default_registry[name].count, equal_to(1))
+
+
+class TestSpan:
+    @pytest.fixture
+    def clock(self) -> t.Callable[[], int]:
+        return itertools.count(0, 250_000_000).__next__
+
+    def test__tree(self, clock) -> None:
+        with Timer(clock=clock, name="request", trace=True) as timer:
+            with Timer(clock=clock, name="db"), Timer(clock=clock, name="query"):
+                assert_that(current_span().name, equal_to("query"))
+            with Timer(clock=clock, name="render"):
+                ...
+            with Timer(clock=clock, name="ignored", trace=False):
+                ...
+
+        assert_that(current_span(), equal_to(None))
+        assert_that(
+            [(depth, span.name, span.total_ns, span.self_ns) for depth, span in timer.span.walk()],
+            equal_to(
+                [
+                    (0, "request", 2_250_000_000, 1_250_000_000),
+                    (1, "db", 750_000_000, 500_000_000),
+                    (2, "query", 250_000_000, 250_000_000),
+                    (1, "render", 250_000_000, 250_000_000),
+                ]
+            ),
+        )
+        assert_that(
+            timer.span.render(precision=1),
+            equal_to(
+                "request: 0:00:02.2 (self 0:00:01.2)\n"
+                "  db: 0:00:00.8 (self 0:00:00.5)\n"
+                "    query: 0:00:00.2 (self 0:00:00.2)\n"
+                "  render: 0:00:00.2 (self 0:00:00.2)"
+            ),
+        )
+
+    def test__not_traced(self) -> None:
+        with Timer() as outer, Timer() as inner:
+            ...
+
+        assert_that((outer.span, inner.span), equal_to((None, None)))
+
+    def test__asyncio_tasks(self) -> None:
+        async def child(name: str) -> None:
+            async with Timer(name=name):
+                await asyncio.sleep(0)
+
+        async def main() -> Timer:
+            async with Timer(name="main", trace=True) as timer:
+                await asyncio.gather(child("a"), child("b"))
+            return timer
+
+        span = asyncio.run(main()).span
+        assert_that([child.name for child in span.children], equal_to(["a", "b"]))
+        assert_that(span.self_ns >= 0, equal_to(True))
+
+    def test__threads_are_separate(self) -> None:
+        with Timer(name="main", trace=True) as timer, ThreadPoolExecutor() as executor:
+            executor.submit(lambda: Timer(name="thread").__enter__()).result()
+
+        assert_that(timer.span.children, equal_to([]))
+
+
+class TestDeadline:
+    def test__remaining(self) -> None:
+        deadline = Deadline(
+            1.5, clock=mock.Mock(side_effect=[0, 500_000_000, 1_000_000_000, 2_000_000_000])
+        )
+
+        with deadline:
+            assert_that(deadline.remaining(), equal_to(1.0))
+            assert_that(deadline.expired, equal_to(False))
+
+        assert_that(deadline.remaining_ns(), equal_to(0))
+        assert_that(deadline.expired, equal_to(True))
+        assert_that(deadline.budget, equal_to(1.5))
+
+    def test__loop(self) -> None:
+        deadline = Deadline(0.1, clock=itertools.count(0, 10_000_000).__next__)
+        processed = 0
+
+        with deadline:
+            while not deadline.expired:
+                processed += 1
+
+        assert_that(processed, equal_to(9))
+
+    def test__on_expire(self) -> None:
+        on_expire = mock.Mock()
+
+        with Deadline(0, on_expire=on_expire) as deadline:
+            ...
+
+        on_expire.assert_called_once_with(deadline)
+
+    def test__raise_on_expire(self) -> None:
+        with pytest.raises(DeadlineExceeded), Deadline(0, raise_on_expire=True):
+            ...
+        with Deadline(10, raise_on_expire=True) as deadline:
+            deadline.check()
+
+    def test__raise_on_expire__keeps_block_exception(self) -> None:
+        on_expire = mock.Mock()
+
+        with pytest.raises(KeyError), Deadline(0, on_expire=on_expire, raise_on_expire=True):
+            raise KeyError("key")
+        on_expire.assert_called_once()
+
+    def test__check(self) -> None:
+        with pytest.raises(DeadlineExceeded), Deadline(0) as deadline:
+            deadline.check()
+
+    def test__negative_budget(self) -> None:
+        with pytest.raises(ValueError):
+            Deadline(-1)
+
+    def test__async_cancel(self) -> None:
+        on_expire = mock.Mock()
+
+        async def main() -> None:
+            async with Deadline(0.01, on_expire=on_expire):
+                await asyncio.sleep(10)
+
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(main())
+        on_expire.assert_called_once()
+
+    def test__async_in_time(self) -> None:
+        async def main() -> Deadline:
+            async with Deadline(10) as deadline:
+                await asyncio.sleep(0)
+            await asyncio.sleep(0.01)
+            return deadline
+
+        deadline = asyncio.run(main())
+        assert_that(deadline.expired, equal_to(False))
+
+    def test__async_pause(self) -> None:
+        elapsed = []
+
+        async def main() -> None:
+            async with Deadline(
+                0.05, on_expire=lambda deadline: elapsed.append(deadline.elapsed)
+            ) as deadline:
+                deadline.pause()
+                await asyncio.sleep(0.1)
+                deadline.resume()
+                await asyncio.sleep(10)
+
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(main())
+        assert_that(elapsed[0], close_to(0.05, 0.04))
+
+    def test__async_external_cancel(self) -> None:
+        async def main() -> None:
+            task = asyncio.current_task()
+            asyncio.get_running_loop().call_later(0.01, task.cancel)
+            async with Deadline(10):
+                await asyncio.sleep(1)
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main())
+
+    @pytest.mark.skipif(sys.version_info < (3, 11), reason="needs Task.cancelling()")
+    def test__async_after_caught_cancel(self) -> None:
+        async def main() -> None:
+            task = asyncio.current_task()
+            task.cancel()
+            # caught without uncancel(), the task is still cancelling
+            with contextlib.suppress(asyncio.CancelledError):
+                await asyncio.sleep(1)
+            async with Deadline(0.01):
+                await asyncio.sleep(1)
+
+        with pytest.raises(DeadlineExceeded):
+            asyncio.run(main())
+
+    def test__async_raise_on_expire__keeps_block_exception(self) -> None:
+        async def main() -> None:
+            async with Deadline(0, raise_on_expire=True):
+                raise KeyError("key")
+
+        with pytest.raises(KeyError):
+            asyncio.run(main())
+
+    def test__async_raise_on_expire__keeps_external_cancel(self) -> None:
+        async def main() -> None:
+            task = asyncio.current_task()
+            asyncio.get_running_loop().call_later(0.02, task.cancel)
+            async with Deadline(0.01, raise_on_expire=True, cancel=False):
+                await asyncio.sleep(1)
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(main())
+
+    def test__async_no_cancel(self) -> None:
+        async def main() -> Deadline:
+            async with Deadline(0.01, cancel=False) as deadline:
+                await asyncio.sleep(0.02)
+            return deadline
+
+        assert_that(asyncio.run(main()).expired, equal_to(True))